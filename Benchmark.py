@@ -0,0 +1,278 @@
+# Copyright (c) 2010, Trevor Bekolay
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice, this
+#      list of conditions and the following disclaimer in the documentation and/or other
+#      materials provided with the distribution.
+#    * Neither the name of the IRCL nor the names of its contributors may be used to
+#      endorse or promote products derived from this software without specific prior
+#      written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT
+# OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR 
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os, shutil, sys, tempfile, time
+import Codegen
+import Io
+import Parser
+
+def MakeBehaviour(verb_count, nwvar_count, name="Bench"):
+    """Build a synthetic behaviour for benchmarking.
+
+    Every third variable is an actor; the rest cycle through the other NWScript
+    types.  Each verb gets a couple of preconditions and arguments, and all but
+    the last verb (which is terminal) have two followers.
+    @param verb_count: The number of verbs in the behaviour.
+    @type verb_count: int
+    @param nwvar_count: The number of actors and variables in the behaviour.
+    @type nwvar_count: int
+    @keyword name: The name of the behaviour.
+    @type name: string
+    @return: The synthetic behaviour.
+    @rtype: L{Behaviour}
+    """
+    behaviour = Codegen.Behaviour()
+    behaviour.name = name
+
+    for ix in range(nwvar_count):
+        if ix % 3 == 0:
+            behaviour.nwvariables.append(Codegen.NWVariable(type="object",
+                                                            name="oActor%d" % ix,
+                                                            description="Actor %d" % ix,
+                                                            isActor=True))
+        else:
+            type = Codegen.valid_nwvar_types[ix % 4]
+            behaviour.nwvariables.append(Codegen.NWVariable(type=type,
+                                                            name="%cVariable%d" % (type[0], ix),
+                                                            description="Variable %d" % ix,
+                                                            isActor=False))
+
+    for ix in range(verb_count):
+        verb = Codegen.Verb(behaviour)
+        verb.context_name = "Verb%d" % ix
+        verb.actual_name = "FaceAndSayLine"
+        verb.follower = ix % 2 == 0
+        verb.terminal = ix == verb_count - 1
+        verb.preconditions.append("GetDistanceBetween(oActor0, GetFirstPC()) < 5.0")
+        verb.preconditions.append("!GetIsDead(oActor0)")
+        verb.vdarguments.append("oActor0")
+        verb.vdarguments.append("GetFirstPC()")
+        verb.varguments.append("\"Line number %d\"" % ix)
+        behaviour.verbs.append(verb)
+
+    for ix, verb in enumerate(behaviour.verbs):
+        if verb.terminal == False:
+            verb.followers.append(behaviour.verbs[ix+1])
+            verb.followers.append(behaviour.verbs[(ix*7) % verb_count])
+
+    return behaviour
+
+def TimeCalls(function, duration=2.0):
+    """Call a function repeatedly for (at least) the given duration.
+    @param function: The function to call; it is passed no arguments.
+    @type function: callable
+    @keyword duration: How long to keep calling the function, in seconds.
+    @type duration: float
+    @return: The number of calls made per second.
+    @rtype: float
+    """
+    calls = 0
+    start = time.time()
+    elapsed = 0.0
+    while elapsed < duration:
+        function()
+        calls += 1
+        elapsed = time.time() - start
+    return calls / elapsed
+
+def BenchmarkGeneration(duration=2.0):
+    """Report how many behaviours per second GenerateBCode can produce.
+    @keyword duration: How long to run each measurement, in seconds.
+    @type duration: float
+    """
+    print "Code generation (behaviours generated per second)"
+    for verb_count, nwvar_count in ((10, 6), (100, 30), (300, 100), (20, 500)):
+        behaviour = MakeBehaviour(verb_count, nwvar_count)
+        rate = TimeCalls(behaviour.GenerateBCode, duration)
+        print "  %3d verbs, %3d variables: %10.1f" % (verb_count, nwvar_count, rate)
+
+def BenchmarkRegeneration(duration=2.0):
+    """Report how many times per second a behaviour can be regenerated when
+    one verb changes between generations, as happens when editing in the GUI.
+    @keyword duration: How long to run each measurement, in seconds.
+    @type duration: float
+    """
+    print "Regeneration after editing one verb (behaviours generated per second)"
+    for verb_count, nwvar_count in ((10, 6), (100, 30), (300, 100)):
+        behaviour = MakeBehaviour(verb_count, nwvar_count)
+        verb = behaviour.verbs[verb_count / 2]
+        def EditAndGenerate():
+            verb.preconditions[0] = verb.preconditions[0]
+            behaviour.GenerateBCode()
+        rate = TimeCalls(EditAndGenerate, duration)
+        print "  %3d verbs, %3d variables: %10.1f" % (verb_count, nwvar_count, rate)
+
+def ModelSize(verbs):
+    """Estimate the memory used by a list of verbs.
+
+    This adds up C{sys.getsizeof} for each verb, its instance dictionary (if
+    it has one) and its lists.  Strings are not counted, as they are shared
+    between verbs.  Requires Python 2.6 or later.
+    @param verbs: The verbs to measure.
+    @type verbs: list of L{Verb}s
+    @return: The approximate size of the verbs, in bytes.
+    @rtype: int
+    """
+    size = sys.getsizeof(verbs)
+    for verb in verbs:
+        size += sys.getsizeof(verb)
+        if hasattr(verb, "__dict__"):
+            size += sys.getsizeof(verb.__dict__)
+        for attribute in ("followers", "preconditions", "vdarguments", "varguments"):
+            size += sys.getsizeof(getattr(verb, attribute))
+    return size
+
+def BenchmarkModel(verb_count=100000):
+    """Report how quickly verbs can be created, and how much memory they use.
+    @keyword verb_count: The number of verbs to create.
+    @type verb_count: int
+    """
+    print "Verb model (%d verbs)" % verb_count
+    behaviour = Codegen.Behaviour()
+    behaviour.name = "Bench"
+
+    start = time.time()
+    verbs = []
+    for ix in range(verb_count):
+        verb = Codegen.Verb(behaviour)
+        verb.context_name = "Verb%d" % (ix % 300)
+        verb.actual_name = "FaceAndSayLine"
+        verb.follower = ix % 2 == 0
+        verb.preconditions.append("!GetIsDead(oActor0)")
+        verb.vdarguments.append("oActor0")
+        verbs.append(verb)
+    elapsed = time.time() - start
+    print "  Created:        %10.1f verbs per second" % (verb_count / elapsed)
+
+    start = time.time()
+    for verb in verbs:
+        verb.constant_name
+    elapsed = time.time() - start
+    print "  Constant names: %10.1f verbs per second" % (verb_count / elapsed)
+
+    if hasattr(sys, "getsizeof"):
+        print "  Memory:         %10.1f bytes per verb" % (float(ModelSize(verbs)) / verb_count)
+
+def MakeHeader(verb_count, nwvar_count):
+    """Build the opening comment block of a synthetic behaviour's b_ script.
+    @param verb_count: The number of verbs in the behaviour.
+    @type verb_count: int
+    @param nwvar_count: The number of actors and variables in the behaviour.
+    @type nwvar_count: int
+    @return: The lines of the comment block, followed by the line after it.
+    @rtype: list of strings
+    """
+    behaviour = MakeBehaviour(verb_count, nwvar_count)
+    behaviour.AllocateVerbIds()
+
+    lines = ["/* CODE GENERATED BY BEHAVIOUR TOOL\n",
+             "Don't delete this comment block!\n",
+             "BEHAVIOUR: %s\n" % (behaviour.name)]
+    for index, verb in enumerate(behaviour.verbs):
+        lines.append(verb.GenerateInfo(index+1) + "\n")
+    for index, nwvar in enumerate(behaviour.nwvariables):
+        if nwvar.isActor == True:
+            lines.append("ACTOR%d: %s %s %s\n" % (index+1, nwvar.type, nwvar.name, nwvar.description))
+        else:
+            lines.append("VARIABLE%d: %s %s %s\n" % (index+1, nwvar.type, nwvar.name, nwvar.description))
+    lines.append(" */\n")
+    return ''.join(lines).splitlines(True)
+
+def BenchmarkParsing(duration=2.0):
+    """Report how quickly ParseBehaviour reads the opening comment block.
+    @keyword duration: How long to run each measurement, in seconds.
+    @type duration: float
+    """
+    print "Parsing (header lines parsed per second)"
+    for verb_count, nwvar_count in ((10, 6), (1000, 30), (10000, 100)):
+        script = MakeHeader(verb_count, nwvar_count)
+        rate = TimeCalls(lambda: Parser.ParseBehaviour(script), duration)
+        print "  %5d verbs, %3d variables: %12.1f" % (verb_count, nwvar_count, rate * len(script))
+
+def MakeVerbLibrary(verb_count):
+    """Build a synthetic C{util_verbs.nss} script.
+    @param verb_count: The number of verbs in the script.
+    @type verb_count: int
+    @return: The lines of the script.
+    @rtype: list of strings
+    """
+    lines = ['#include "z_verbs"\n']
+    for ix in range(verb_count):
+        lines.extend(["\n",
+                      "/* Verb%d verb\n" % ix,
+                      "Description: oSubject does thing number %d to oDirObject\n" % ix,
+                      "VerbData Arguments: oSubject oDirObject\n",
+                      "Verb Arguments:\n",
+                      "    string sLine [Mandatory] - The line oSubject says.\n",
+                      "    float fSpeed [Optional] - How fast oSubject does it.\n",
+                      "*/\n",
+                      "void Verb%d(struct verbData vData, string sLine, float fSpeed=1.0);\n" % ix])
+    return lines
+
+def BenchmarkVerbLibrary(duration=2.0):
+    """Report how quickly ParseVerbs indexes a C{util_verbs.nss} script, and
+    how quickly the verbs' details are parsed afterwards.
+    @keyword duration: How long to run each measurement, in seconds.
+    @type duration: float
+    """
+    print "Verb library (verbs per second)"
+    for verb_count in (10, 1000, 10000):
+        script = MakeVerbLibrary(verb_count)
+        indexed = TimeCalls(lambda: Parser.ParseVerbs(script), duration)
+        def LoadAll():
+            for verb in Parser.ParseVerbs(script):
+                verb.Load()
+        loaded = TimeCalls(LoadAll, duration)
+        print "  %5d verbs: %12.1f indexed, %12.1f fully parsed" % \
+            (verb_count, indexed * verb_count, loaded * verb_count)
+
+def BenchmarkLoading(duration=2.0):
+    """Report how quickly b_ scripts are loaded with and without the parse cache.
+    @keyword duration: How long to run each measurement, in seconds.
+    @type duration: float
+    """
+    print "Loading (behaviours loaded per second)"
+    directory = tempfile.mkdtemp()
+    old_cache_directory = Io.cache_directory
+    try:
+        for verb_count, nwvar_count in ((10, 6), (1000, 30)):
+            path = os.path.join(directory, "b_bench%d.nss" % verb_count)
+            Io.SaveBFile(path, MakeBehaviour(verb_count, nwvar_count))
+            Io.cache_directory = None
+            uncached = TimeCalls(lambda: Io.LoadBehaviour(path), duration)
+            Io.cache_directory = os.path.join(directory, "cache")
+            cached = TimeCalls(lambda: Io.LoadBehaviour(path), duration)
+            print "  %5d verbs: %10.1f uncached, %10.1f cached" % (verb_count, uncached, cached)
+    finally:
+        Io.cache_directory = old_cache_directory
+        shutil.rmtree(directory, True)
+
+if __name__ == '__main__':
+    BenchmarkGeneration()
+    BenchmarkRegeneration()
+    BenchmarkModel()
+    BenchmarkParsing()
+    BenchmarkVerbLibrary()
+    BenchmarkLoading()
@@ -23,116 +23,1070 @@
 # TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
 # EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import re
+
 valid_nwvar_types = ("object", "int", "float", "string")
 """A tuple containing the valid variable types in NWScript.
 @type: tuple of strings
 """
 
+observed_verb_lists = ("preconditions", "followers", "vdarguments", "varguments", "events")
+"""The names of the L{Verb} attributes that are kept in L{ObservableList}s.
+@type: tuple of strings
+"""
+
+verb_attributes = ("context_name", "b_name", "actual_name", "follower", "terminal", "verb_id") + observed_verb_lists
+"""The names of the L{Verb} attributes that describe the verb, as opposed to its caches.
+@type: tuple of strings
+"""
+
+verb_events = (("perception", 1), ("damage", 2), ("area_enter", 4), ("conversation_end", 8))
+"""The world events that verbs can be re-evaluated on, as C{(name, bit)} pairs.
+@type: tuple of tuples
+"""
+
+all_events = 15
+"""The mask with every event's bit set.
+@type: int
+"""
+
+behaviour_options = (("shared_loader", False),
+                     ("eliminate_dead_verbs", False),
+                     ("hoist_preconditions", False),
+                     ("event_driven", False),
+                     ("event_poll_ticks", 4),
+                     ("backoff_idle_ticks", 0),
+                     ("backoff_cap", 8),
+                     ("scheduled", False),
+                     ("bitset_cues", False),
+                     ("order_preconditions", False),
+                     ("instruction_budget", 0),
+                     ("pool_size", 0),
+                     ("dispatch_threshold", 64),
+                     ("suspend_paused", False),
+                     ("direct_completion", False))
+"""The optional code generation modes of a L{Behaviour}, as C{(attribute, default)} pairs.
+
+Options that are not set to their defaults are recorded on the OPTIONS line
+of the b_ file's opening comment block, so they survive being reloaded.
+@type: tuple of tuples
+"""
+
+identifier_re = re.compile(r"[A-Za-z_]\w*")
+"""Matches an NWScript identifier.
+@type: compiled regular expression
+"""
+
+string_literal_re = re.compile(r'"(?:\\.|[^"\\])*"')
+"""Matches an NWScript string literal.
+@type: compiled regular expression
+"""
+
+call_re = re.compile(r"(?<![\w.])[A-Za-z_]\w*\s*\(")
+"""Matches the start of a function call, up to its opening parenthesis.
+@type: compiled regular expression
+"""
+
+nwscript_return_types = {
+    "GetArea":"object", "GetAttackTarget":"object", "GetEnteringObject":"object",
+    "GetFirstPC":"object", "GetItemInSlot":"object", "GetItemPossessedBy":"object",
+    "GetLastAttacker":"object", "GetLastPerceived":"object", "GetLocalObject":"object",
+    "GetMaster":"object", "GetModule":"object", "GetNearestCreature":"object",
+    "GetNearestCreatureToLocation":"object", "GetNearestObject":"object",
+    "GetNearestObjectByTag":"object", "GetNearestObjectToLocation":"object",
+    "GetObjectByTag":"object", "GetPCSpeaker":"object", "GetWaypointByTag":"object",
+    "GetDistanceBetween":"float", "GetDistanceBetweenLocations":"float",
+    "GetDistanceToObject":"float", "GetFacing":"float", "GetLocalFloat":"float",
+    "GetAbilityScore":"int", "GetCurrentAction":"int", "GetCurrentHitPoints":"int",
+    "GetGold":"int", "GetHasSpellEffect":"int", "GetHitDice":"int", "GetIsDay":"int",
+    "GetIsDead":"int", "GetIsEnemy":"int", "GetIsFriend":"int", "GetIsInCombat":"int",
+    "GetIsNeutral":"int", "GetIsNight":"int", "GetIsObjectValid":"int", "GetIsPC":"int",
+    "GetLevelByClass":"int", "GetLocalInt":"int", "GetMaxHitPoints":"int",
+    "GetObjectHeard":"int", "GetObjectSeen":"int", "GetObjectType":"int",
+    "GetRacialType":"int", "GetReputation":"int", "GetTimeHour":"int",
+    "IsInConversation":"int",
+    "GetLocalString":"string", "GetName":"string", "GetResRef":"string", "GetTag":"string",
+    "GetLocalLocation":"location", "GetLocation":"location",
+    "GetPosition":"vector"}
+"""The return types of the engine functions whose results can be hoisted out of
+the cue loop, keyed by function name.
+
+Calls to functions that aren't listed here are never hoisted, since we
+wouldn't know what type of local to store them in.  Functions whose results
+are meant to differ from call to call (C{Random}, C{d20}, etc.) must not be
+added.
+@type: dict
+"""
+
+type_prefixes = {"int":"i", "float":"f", "object":"o", "string":"s",
+                 "location":"l", "vector":"v"}
+"""The prefix given to the names of generated locals of each type.
+@type: dict
+"""
+
+cue_word_bits = 31
+"""How many cues are kept in each int when cues are kept as bits.  The
+sign bit is left alone, so a word only ever gets smaller as cues are removed.
+@type: int
+"""
+
+suspended_poll_ticks = 20
+"""How many heartbeats a suspended behaviour waits between checks (see
+L{Behaviour.suspend_paused}).  This is the fallback for when nothing wakes it
+sooner; it still has to notice if it has been finished or told to segue.
+@type: int
+"""
+
+finished_local = "b_finished"
+"""The local on a behaviour object that C{setBehaviourFinished} is assumed to
+set.  C{util_bhvr_object} isn't part of this tool, so the name can't be
+checked here.  C{setBehaviourFinished} can't clear the flag, so a pooled
+object has the local deleted instead; if the flag is still set afterwards,
+C{release_<Behaviour>} destroys the object rather than pool it.
+@type: string
+"""
+
+nwscript_costs = {
+    "GetIsDead":1, "GetIsObjectValid":1, "GetIsPC":1, "GetIsDay":1, "GetIsNight":1,
+    "GetTimeHour":1, "GetLocalInt":1, "GetLocalFloat":1, "GetLocalString":1,
+    "GetLocalObject":1, "GetLocalLocation":1, "GetModule":1, "GetFirstPC":1,
+    "GetMaster":1, "GetArea":1, "GetTag":1, "GetName":1, "GetResRef":1,
+    "GetObjectType":1, "GetRacialType":1, "GetGold":1, "IntToString":1,
+    "SetLocalInt":1, "SetLocalFloat":1, "SetLocalString":1, "SetLocalObject":1,
+    "GetCurrentHitPoints":2, "GetMaxHitPoints":2, "GetHitDice":2, "GetAbilityScore":2,
+    "GetLevelByClass":2, "GetCurrentAction":2, "GetIsInCombat":2, "IsInConversation":2,
+    "GetAttackTarget":2, "GetLastAttacker":2, "GetLastPerceived":2, "GetPCSpeaker":2,
+    "GetEnteringObject":2, "GetFacing":2, "GetPosition":2, "GetLocation":2,
+    "GetReputation":3, "GetIsEnemy":3, "GetIsFriend":3, "GetIsNeutral":3,
+    "GetHasSpellEffect":4, "GetItemInSlot":4, "GetDistanceBetween":4,
+    "GetDistanceBetweenLocations":4, "GetDistanceToObject":4,
+    "GetObjectSeen":8, "GetObjectHeard":8, "GetItemPossessedBy":16,
+    "GetObjectByTag":20, "GetWaypointByTag":20,
+    "GetNearestObject":30, "GetNearestObjectByTag":30, "GetNearestObjectToLocation":30,
+    "GetNearestCreature":40, "GetNearestCreatureToLocation":40}
+"""Rough costs of calling engine functions, keyed by function name, used to
+decide which preconditions to test first.
+
+Accessors that just read a field of an object are cheap, while anything
+that searches the area (e.g. C{GetNearestCreature}) is expensive.  The costs
+are in the same units as profiled timings, so the two can be mixed.
+@type: dict
+"""
+
+default_call_cost = 10
+"""The cost of calling a function that isn't in L{nwscript_costs}, such as a
+user-defined function.
+@type: int
+"""
+
+default_rejection = 0.5
+"""How often a precondition is assumed to fail, if it hasn't been profiled.
+@type: float
+"""
+
+instruction_re = re.compile(r'//[^\n]*|"(?:\\.|[^"\\])*"|[A-Za-z_]\w*\s*\(|[\w.]+|[-+*/%<>=!&|^~]+')
+"""Matches the tokens in NWScript code that each cost the virtual machine
+an instruction or so: literals, names, operators and function calls.  Also
+matches comments, so they can be skipped.
+@type: compiled regular expression
+"""
+
+script_call_instructions = 50
+"""The number of instructions a call to a function written in NWScript is
+assumed to cost, for functions that aren't engine functions in L{nwscript_costs}.
+@type: int
+"""
+
+dispatch_leaf_cases = 8
+"""The most cases left in each switch statement at the bottom of a split dispatch.
+@type: int
+"""
+
+placeholder_re = re.compile(r"%\((\w+)\)s")
+"""Matches the C{%(section)s} placeholders in a code generation shell.
+@type: compiled regular expression
+"""
+
+def Intern(value):
+    """Intern a name, so that the many verbs and variables sharing the same
+    names also share the same string objects.
+    @param value: The name.
+    @type value: string
+    @return: The interned name, or the name as passed if it can't be interned
+        (e.g. a unicode string from the GUI).
+    @rtype: string
+    """
+    if type(value) is str:
+        return intern(value)
+    return value
+
+def MaskStringLiterals(expression):
+    """Blank out the contents of the string literals in an NWScript expression,
+    keeping the positions of everything else the same.
+    @param expression: The expression.
+    @type expression: string
+    @return: The expression, with each string literal's contents replaced by spaces.
+    @rtype: string
+    """
+    return string_literal_re.sub(lambda match: '"' + " " * (len(match.group(0)) - 2) + '"', expression)
+
+def SubstituteHoisted(expression, hoisted):
+    """Replace the hoisted calls in an NWScript expression with the locals
+    holding them.  Calls inside string literals are left alone.
+    @param expression: The expression.
+    @type expression: string
+    @param hoisted: The calls that have been hoisted out of the cue loop
+        (see L{Behaviour.FindHoistedCalls}), innermost first.  Each call is
+        written in terms of the locals before it, so they are substituted
+        in order.
+    @type hoisted: tuple of tuples
+    @return: The expression, using the locals.
+    @rtype: string
+    """
+    for call, local, type in hoisted:
+        if expression.find(call) == -1:
+            continue
+        masked = MaskStringLiterals(expression)
+        pieces = []
+        last = 0
+        for match in re.finditer(r"(?<![\w.])" + re.escape(MaskStringLiterals(call)), masked):
+            # The match could be the blanked out contents of a literal.
+            if expression[match.start():match.end()] != call:
+                continue
+            pieces.append(expression[last:match.start()])
+            pieces.append(local)
+            last = match.end()
+        pieces.append(expression[last:])
+        expression = ''.join(pieces)
+    return expression
+
+def FindCalls(expression):
+    """Find every function call in an NWScript expression, including the ones
+    nested inside other calls.  Calls inside string literals are ignored.
+    @param expression: The expression to search.
+    @type expression: string
+    @return: The text of each call, from its name to its closing parenthesis,
+        in the order the calls start.
+    @rtype: list of strings
+    """
+    masked = MaskStringLiterals(expression)
+
+    calls = []
+    for match in call_re.finditer(masked):
+        depth = 0
+        for ix in range(match.end() - 1, len(masked)):
+            if masked[ix] == "(":
+                depth += 1
+            elif masked[ix] == ")":
+                depth -= 1
+                if depth == 0:
+                    calls.append(expression[match.start():ix + 1])
+                    break
+    return calls
+
+def GetSchedulerSections(behaviours):
+    """Get the code for each section of the scheduler shell.
+    @param behaviours: The behaviours in the module.  Only the ones that are
+        L{scheduled<Behaviour.scheduled>} are run by the scheduler.
+    @type behaviours: list of L{Behaviour}s
+    @return: The code for each section, keyed by section name.
+    @rtype: dict
+    """
+    includes_list = []
+    ticks_list = []
+    seen = set()
+    for behaviour in behaviours:
+        lower_name = behaviour.name.lower()
+        upper_name = behaviour.name.capitalize()
+        if behaviour.scheduled == False or lower_name in seen:
+            continue
+        seen.add(lower_name)
+
+        # #include "b_<behaviour name all lowercase>"
+        # e.g.:
+        # #include "b_fight"
+        includes_list.append("#include \"b_%s\"" % (lower_name))
+
+        # Behaviours are run one kind at a time, most recently started first.
+        # One that finishes takes the last one's place, which has already
+        # been run by then.
+        ticks_list.append("""
+    for (ix = GetLocalInt(oModule, "b_scheduled_%(lower_name)s") - 1; ix >= 0; ix--)
+    {
+        tick_%(upper_name)s(GetLocalInt(oModule, "b_scheduled_%(lower_name)s_" + IntToString(ix)));
+    }""" % {"lower_name":lower_name, "upper_name":upper_name})
+
+    return {"includes":'\n'.join(includes_list), "ticks":''.join(ticks_list)}
+
+def GenerateSchedulerCode(behaviours):
+    """Generate the module's scheduler script, which runs the heartbeat of
+    every scheduled behaviour instance.
+    @param behaviours: The behaviours in the module.  Only the ones that are
+        L{scheduled<Behaviour.scheduled>} are run by the scheduler.
+    @type behaviours: list of L{Behaviour}s
+    @return: The generated NWScript code.
+    @rtype: string
+    """
+    return scheduler_template.Render(GetSchedulerSections(behaviours))
+
+def WriteSchedulerCode(stream, behaviours):
+    """Generate the module's scheduler script, writing it to a file-like object.
+    @param stream: Where the code is written; only its C{write} method is used.
+    @type stream: file
+    @param behaviours: The behaviours in the module.  Only the ones that are
+        L{scheduled<Behaviour.scheduled>} are run by the scheduler.
+    @type behaviours: list of L{Behaviour}s
+    """
+    scheduler_template.Write(stream, GetSchedulerSections(behaviours))
+
+def PreconditionCost(precondition, timings=None, hoisted=()):
+    """Estimate the cost of testing a precondition, and how often it fails.
+    @param precondition: The precondition.
+    @type precondition: string
+    @param timings: Measured timings from a profiling run, keyed by
+        precondition.  Each is either the precondition's cost, or a
+        C{(cost, rejection rate)} pair.
+    @type timings: dict
+    @param hoisted: The calls that have been hoisted out of the cue loop
+        (see L{Behaviour.FindHoistedCalls}); they only cost a local lookup.
+    @type hoisted: tuple of tuples
+    @return: The cost, and the fraction of the time the precondition fails.
+    @rtype: tuple
+    """
+    if timings is not None and precondition in timings:
+        timing = timings[precondition]
+        if isinstance(timing, tuple):
+            return timing
+        return (timing, default_rejection)
+
+    precondition = SubstituteHoisted(precondition, hoisted)
+
+    cost = 1
+    for call in FindCalls(precondition):
+        cost += nwscript_costs.get(call[:call.find("(")].strip(), default_call_cost)
+    return (cost, default_rejection)
+
+def OrderPreconditions(preconditions, timings=None, hoisted=()):
+    """Order preconditions so the cheap ones that are likely to fail are tested
+    first, and short-circuit the expensive ones.
+
+    Preconditions are sorted by cost over rejection rate, which minimizes the
+    expected cost of testing them all.  Preconditions with an C{||} outside
+    parentheses can't be moved without changing what the joined expression
+    means, so if there are any, the order is left alone.
+    @param preconditions: The preconditions, in the order they were written.
+    @type preconditions: list of strings
+    @param timings: Measured timings from a profiling run (see L{PreconditionCost}).
+    @type timings: dict
+    @param hoisted: The calls that have been hoisted out of the cue loop.
+    @type hoisted: tuple of tuples
+    @return: The preconditions, in the order they should be tested.
+    @rtype: tuple of strings
+    """
+    for precondition in preconditions:
+        masked = string_literal_re.sub('""', precondition)
+        depth = 0
+        for ix, char in enumerate(masked):
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            elif depth == 0 and (masked.startswith("||", ix) or char == "?"):
+                return tuple(preconditions)
+
+    def rank(precondition):
+        cost, rejection = PreconditionCost(precondition, timings, hoisted)
+        if rejection <= 0:
+            return float("inf")
+        return float(cost) / rejection
+    return tuple(sorted(preconditions, key=rank))
+
+def EstimateInstructions(code):
+    """Roughly estimate how many instructions the NWScript virtual machine
+    runs to execute some code, assuming every statement in it runs.
+    @param code: The NWScript code.
+    @type code: string
+    @return: The estimated number of instructions.
+    @rtype: int
+    """
+    instructions = 0
+    for token in instruction_re.findall(code):
+        if token.startswith("//"):
+            continue
+        elif token.endswith("(") and token[:-1].strip() not in nwscript_costs and \
+             token[:-1].strip() not in ("if", "while", "for", "switch", "return"):
+            instructions += script_call_instructions
+        else:
+            instructions += 1
+    return instructions
+
+def Indent(code, levels):
+    """Indent every non-blank line of some NWScript code.
+    @param code: The code.
+    @type code: string
+    @param levels: How many levels of four spaces to add.
+    @type levels: int
+    @return: The indented code.
+    @rtype: string
+    """
+    if levels == 0:
+        return code
+    return re.sub(r"(?m)^(?=.)", "    " * levels, code)
+
+def GetDispatch(variable, cases, depth, threshold):
+    """Get the statement that runs the case matching a variable's value.
+
+    Small dispatches are a single switch statement, which NWScript runs as a
+    chain of comparisons.  If there are more than C{threshold} cases, the
+    range of values is split in half by nested if statements until each half
+    has no more than L{dispatch_leaf_cases} cases, and only those go in a switch.
+    @param variable: The variable being switched on.
+    @type variable: string
+    @param cases: The cases, as C{(value, value name, case code)} tuples.  The
+        case code must be indented for a switch statement at C{depth}.
+    @type cases: list of tuples
+    @param depth: How many levels the statement is indented.
+    @type depth: int
+    @param threshold: The most cases a single switch statement can have, or 0
+        for no limit.
+    @type threshold: int
+    @return: The code, as a list of chunks (see L{Chunks}).
+    @rtype: list of strings
+    """
+    pad = "    " * depth
+    if threshold == 0 or len(cases) <= threshold:
+        return ["%sswitch (%s)\n%s{\n" % (pad, variable, pad)] + \
+               Chunks([case for value, name, case in cases], '\n') + ["\n%s}" % (pad)]
+
+    cases = sorted(cases)
+    chunks = []
+    def split(lower, upper, levels):
+        pad = "    " * (depth + levels)
+        if upper - lower <= dispatch_leaf_cases:
+            chunks.append("%sswitch (%s)\n%s{\n" % (pad, variable, pad))
+            chunks.append('\n'.join([Indent(case, levels) for value, name, case in cases[lower:upper]]))
+            chunks.append("\n%s}" % (pad))
+            return
+        middle = (lower + upper) / 2
+        chunks.append("%sif (%s < %s)\n%s{\n" % (pad, variable, cases[middle][1], pad))
+        split(lower, middle, levels + 1)
+        chunks.append("\n%s}\n%selse\n%s{\n" % (pad, pad, pad))
+        split(middle, upper, levels + 1)
+        chunks.append("\n%s}" % (pad))
+    split(0, len(cases), 0)
+    return chunks
+
+def CueMasks(positions):
+    """Group cue bit positions into the words that hold them.
+    @param positions: The bit positions of the cues.
+    @type positions: list of ints
+    @return: C{(word, mask)} pairs, in order of word.
+    @rtype: tuple of tuples
+    """
+    masks = {}
+    for position in positions:
+        word = position / cue_word_bits
+        masks[word] = masks.get(word, 0) | (1 << (position % cue_word_bits))
+    return tuple(sorted(masks.items()))
+
+def Chunks(items, separator):
+    """Interleave a list of strings with a separator.
+
+    This is equivalent to C{separator.join(items)}, except that the result is
+    left as a list of chunks.  L{Template}s accept chunk lists as section
+    values, and can write them out piece by piece without building the
+    joined string.
+    @param items: The strings to interleave.
+    @type items: list of strings
+    @param separator: The string to put between each item.
+    @type separator: string
+    @return: The items and separators, in order.
+    @rtype: list of strings
+    """
+    chunks = []
+    for item in items:
+        chunks.append(item)
+        chunks.append(separator)
+    if len(chunks) > 0:
+        chunks.pop()
+    return chunks
+
 class ActualVerb(object):
     """ActualVerb holds information about an 'actual verb'.
     
-    Actual verbs are the atomic actions defined in util_verbs.nss."""
-    def __init__(self, name="", description=""):
+    Actual verbs are the atomic actions defined in util_verbs.nss.  An
+    ActualVerb can be made from just its name and where it is in the script,
+    in which case the rest of it is parsed the first time it is needed."""
+    __slots__ = ("name", "__description", "__vdarguments", "__varguments",
+                 "source", "offset", "loader")
+
+    def __init__(self, name="", description="", source=None, offset=0, loader=None):
         """Sets up the ActualVerb's instance variables.
         
         @keyword name: The name of the ActualVerb
         @type name: string
         @keyword description: The description of the ActualVerb
         @type description: string
+        @keyword source: The script the ActualVerb was found in.
+        @type source: string
+        @keyword offset: Where the ActualVerb's comment block starts in the script.
+        @type offset: int
+        @keyword loader: The function that parses the rest of the ActualVerb.
+        @type loader: function
         """
-        self.name = name
+        self.name = Intern(name)
         """ The name of the ActualVerb
         @type: string
         """
-        self.description = description
-        """ The description of the ActualVerb
+        self.__description = description
+        self.__vdarguments = []
+        self.__varguments = []
+        self.source = source
+        """ The script the ActualVerb was found in, or None.
         @type: string
         """
-        self.vdarguments = []
-        """ The VerbData arguments that this ActualVerb requires.
-        @type: list of strings
+        self.offset = offset
+        """ Where the ActualVerb's comment block starts in the script.
+        @type: int
         """
-        self.varguments = []
-        """ The arguments that this ActualVerb requires.
-        Comprised of a list of tuples of the form::
-            (Mandatory, Type, Name, Description)
-        e.g.::
-            (True, "float", "fSpeed", "The speed at which the animation plays, relative to the default 1.0")
-        @type: list of tuples
+        self.loader = loader
+        """ The function that parses the rest of the ActualVerb from the script.
+        It is called with the ActualVerb the first time the description or
+        arguments are needed, then set to None.
+        @type: function
         """
 
+    def Load(self):
+        """Parse the rest of the ActualVerb, if that hasn't been done yet."""
+        if self.loader is not None:
+            loader = self.loader
+            self.loader = None
+            loader(self)
+
+def _ActualVerbDetail(name, doc):
+    """Make a property for one of the L{ActualVerb} attributes that are parsed
+    when they are first needed.
+    @param name: The name of the attribute.
+    @type name: string
+    @param doc: The documentation for the attribute.
+    @type doc: string
+    @return: The property.
+    @rtype: property
+    """
+    slot = getattr(ActualVerb, "_ActualVerb__" + name)
+    def get(verb):
+        verb.Load()
+        return slot.__get__(verb)
+    def set(verb, value):
+        verb.Load()
+        slot.__set__(verb, value)
+    return property(get, set, doc=doc)
+
+ActualVerb.description = _ActualVerbDetail("description",
+    """ The description of the ActualVerb
+    @type: string
+    """)
+ActualVerb.vdarguments = _ActualVerbDetail("vdarguments",
+    """ The VerbData arguments that this ActualVerb requires.
+    @type: list of strings
+    """)
+ActualVerb.varguments = _ActualVerbDetail("varguments",
+    """ The arguments that this ActualVerb requires.
+    Comprised of a list of tuples of the form::
+        (Mandatory, Type, Name, Description)
+    e.g.::
+        (True, "float", "fSpeed", "The speed at which the animation plays, relative to the default 1.0")
+    @type: list of tuples
+    """)
+
 class Behaviour(object):
     """An object to hold all of the information necessary to generate the code\
     for a behaviour. Also contains methods to generate said code."""
     def __init__(self):
         """Set up the behaviour's instance variables."""
-        self.verbs = []
+        self.verbs = VerbList()
         """The list of verbs making up this behaviour.
-        @type: list of L{Verb}s
+        @type: L{VerbList}
         """
         self.nwvariables = []
         """The list of variables and actors that are used in this behaviour.
         @type: list of L{NWVariable}s
         """
         self.name = "Behaviour"
+        self.shared_loader = False
+        """Should the actors and variables be fetched through one shared loader?
+
+        Normally every function fetches every actor and variable from the
+        behaviour object.  With the shared loader, a single C{load_<Behaviour>}
+        function returns them in a struct, and each function only fetches the
+        ones it references.  References are found by scanning the verbs'
+        VerbData arguments, verb arguments and preconditions, so code added by
+        hand to the timeout and segue functions won't have any variables.
+        @type: bool
+        """
+        self.eliminate_dead_verbs = False
+        """Should verbs that can never be reached be left out of the b_ script?
+
+        A verb is reachable if it is the first verb, or a follower of a
+        reachable verb.  Unreachable verbs are still listed in the opening
+        comment block so they aren't lost when the script is reloaded, but
+        they get no constant and no case in the switch statements.
+        @type: bool
+        """
+        self.hoist_preconditions = False
+        """Should function calls repeated across the verbs' preconditions be
+        evaluated once per tick, before the cue loop?
+
+        Only calls to the functions in L{nwscript_return_types} are hoisted.
+        The hoisted calls are evaluated on every tick, even when no cued verb
+        needs them or C{&&} and C{||} would have skipped them, and they aren't
+        evaluated again after a verb fires partway through the loop.  So this
+        only pays off when many cues share expensive calls.
+        @type: bool
+        """
+        self.event_driven = False
+        """Should cues be re-evaluated when something happens in the world,
+        instead of on every heartbeat?
+
+        An C{evaluate_<Behaviour>} function holds the cue loop, and a hook
+        is generated for each of the events in L{verb_events} (e.g.
+        C{perception_<Behaviour>(oActor)}), to be called from the actors'
+        event scripts.  A cue is re-evaluated on the events its verb lists in
+        L{Verb.events}, or on any event if the verb doesn't list any.  All the
+        cues are evaluated when a verb completes, and the heartbeat carries on
+        every L{event_poll_ticks} ticks as a fallback.
+        @type: bool
+        """
+        self.event_poll_ticks = 4
+        """How many heartbeats pass between each fallback poll in event-driven mode.
+        @type: int
+        """
+        self.backoff_idle_ticks = 0
+        """How many heartbeats in a row can pass without a cue firing before
+        the heartbeat starts to slow down.
+
+        After that, the delay between checks doubles on every idle heartbeat,
+        up to L{backoff_cap} heartbeats.  It snaps back to the usual delay as
+        soon as a cue fires, or a verb completes.  Timeouts are counted in
+        heartbeats elapsed, so they run out at the same time either way.
+        0 turns backing off off.
+        @type: int
+        """
+        self.backoff_cap = 8
+        """The longest delay between checks when backing off, in heartbeats.
+        @type: int
+        """
+        self.scheduled = False
+        """Should the behaviour be run by the module's shared scheduler, instead
+        of scheduling its own heartbeat?
+
+        A scheduled behaviour registers itself with the scheduler in
+        C{start_<Behaviour>}, and deregisters in C{cleanup_<Behaviour>}.  The
+        scheduler script itself is generated by L{GenerateSchedulerCode}.
+        @type: bool
+        """
+        self.bitset_cues = False
+        """Should the cues be kept as bits in ints on the behaviour object,
+        instead of in an int array?
+
+        Each verb gets a bit, in order, so adding and removing cues is a mask
+        operation, and the cue loop only has to test bits rather than search
+        the array.
+        @type: bool
+        """
+        self.order_preconditions = False
+        """Should each verb's preconditions be reordered so the cheap ones that
+        are likely to fail are tested first?
+
+        Costs come from L{nwscript_costs}, or from L{precondition_timings} when
+        a precondition has been profiled.  See L{OrderPreconditions}.
+        @type: bool
+        """
+        self.precondition_timings = {}
+        """Measured timings from a profiling run, used to order the preconditions.
+
+        Each is keyed by precondition, and is either the precondition's cost
+        or a C{(cost, rejection rate)} pair.  Timings aren't saved in the b_
+        file; see L{Io.LoadPreconditionProfile}.
+        @type: dict
+        """
+        self.instruction_budget = 0
+        """How many instructions each call to C{checkcues_<Behaviour>} may spend
+        checking cues.  0 means there is no limit.
+
+        NWScript aborts scripts that run too many instructions.  With a budget,
+        only as many cues as fit in it (going by L{EstimateInstructions} of the
+        most expensive verb's case) are checked per heartbeat, and the next
+        heartbeat carries on from the next cue.
+        @type: int
+        """
+        self.pool_size = 0
+        """How many finished behaviour objects are kept to be reused by the next
+        runs of this behaviour.  0 turns pooling off.
+
+        With pooling, C{cleanup_<Behaviour>} resets the locals on the behaviour
+        object and puts it in a pool kept on the module, instead of destroying
+        it, and C{start_<Behaviour>} takes an object from the pool before
+        creating one.  A reused object keeps its ID, so it counts the verbs
+        that are still running, and it is destroyed rather than pooled if any
+        are; the heartbeat stops at cleanup, and a wake-up still pending from
+        the last run is turned away by the heartbeat count.  Pooling is meant
+        for short, frequently started behaviours whose verbs don't outlive
+        them.
+        @type: int
+        """
+        self.dispatch_threshold = 64
+        """The most verbs that are dispatched with a single switch statement.
+
+        Above this, the switch statements in the cue loop and in
+        C{control_<Behaviour>} are split into a balanced tree of if statements
+        on the verb's value (see L{GetDispatch}), so finding a verb's case
+        takes a handful of comparisons instead of one per verb.  0 never
+        splits them.
+        @type: int
+        """
+        self.suspend_paused = False
+        """Should the heartbeat all but stop while the behaviour is paused?
+
+        Normally a paused behaviour checks every few heartbeats whether it
+        should segue back in.  A suspended one only checks every
+        L{suspended_poll_ticks} heartbeats, so that it still notices if it is
+        finished or told to segue.  The cleanup of a behaviour that paused it
+        wakes it sooner, through C{z_b_<Behaviour>} and C{resume_<Behaviour>},
+        if that behaviour was generated with this option too.
+        @type: bool
+        """
+        self.direct_completion = False
+        """Should C{z_b_<Behaviour>} find the behaviour through the object it
+        is run on, instead of the module's C{curr_behaviour} local?
+
+        A verb runs the C{z_b_} script on the behaviour object when it
+        completes.  Normally the script reads the behaviour's ID from the
+        module-wide C{curr_behaviour} local, which another completion can
+        overwrite.  With direct completion, it reads the ID from the object
+        itself and hands the completion to C{drain_<Behaviour>}, which calls
+        C{control_<Behaviour>} (or C{timeout_<Behaviour>}) straight away.  A
+        completion that comes in while another is being passed on, from a
+        verb that completes at once, is queued on the object and passed on
+        after it.
+        @type: bool
+        """
+        self.release_build = False
+        """Should the DebugPrint calls made on every heartbeat be left out of
+        the b_ script?
+
+        Release builds don't build and log a string for every cue on every
+        tick.  This is a build setting rather than part of the behaviour, so
+        it isn't saved in the b_ file.
+        @type: bool
+        """
+        self.dropped_verbs = []
+        """The verbs left out the last time the b_ script was generated.
+        @type: list of L{Verb}s
+        """
+    
+    def __GetName(self):
+        """Get the name of the behaviour.
+        @return: The name of the behaviour.
+        @rtype: string
+        """
+        return self.__name
+    
+    def __SetName(self, value):
+        """Change the name and update each verb.
+        @param value: The new name.
+        @type value: string
+        """
+        if len(value) > 12:
+            value = value[:11]
+        for verb in self.verbs:
+            verb.b_name = value
+        
+        self.__name = value
+    
+    name = property(__GetName, __SetName, doc=
         """The name of the behaviour.
         This is contrained to 12 characters, as the maximum length for an NWScript
         file is 16 characters and the behaviour name is prepended with "z_b_" for a script.
         @type: string
-        """
+        """)
     
-    def __setattr__(self, name, value):
-        """Intercept changes to the name and update each verb.
-        @param name: Name of the attribute being set.
-        @type name: string
-        @param value: The value to set the attribute to.
+    def GetOptions(self):
+        """Describe the code generation options that are not set to their defaults.
+        @return: One description per option, e.g. C{shared_loader}.  Options that
+            are off by default are described by their name, options that are on
+            by default are described as C{no_<name>}, and other options as
+            C{<name>=<value>}.
+        @rtype: list of strings
         """
-        if name == "name":
-            if len(value) > 12:
-                value = value[:11]
-            for verb in self.verbs:
-                verb.b_name = value
-        
-        object.__setattr__(self, name, value)
-    
+        options = []
+        for name, default in behaviour_options:
+            value = getattr(self, name)
+            if value == default:
+                continue
+            if value is True:
+                options.append(name)
+            elif value is False:
+                options.append("no_" + name)
+            else:
+                options.append("%s=%s" % (name, value))
+        return options
+
+    def SetOption(self, option):
+        """Set a code generation option from its description.
+        @param option: The description of the option, as returned by L{GetOptions}.
+        @type option: string
+        @raise ValueError: Raised if the option is unknown, or its value is invalid.
+        """
+        if option.find("=") != -1:
+            name, value = option.split("=", 1)
+        elif option.startswith("no_"):
+            name, value = option[3:], False
+        else:
+            name, value = option, True
+
+        defaults = dict(behaviour_options)
+        if name not in defaults:
+            raise ValueError, "Unknown option: %s" % name
+
+        default = defaults[name]
+        if isinstance(value, basestring):
+            if isinstance(default, bool):
+                value = value in ("1", "True", "true")
+            else:
+                value = type(default)(value)
+
+        setattr(self, name, value)
+
+    def FindReachableVerbs(self):
+        """Find the verbs that can be reached from the first verb by following
+        each verb's followers.
+        @return: The reachable verbs, in the order they appear in the behaviour.
+        @rtype: L{VerbList}
+        """
+        if len(self.verbs) == 0:
+            return VerbList()
+
+        reached = set([id(self.verbs[0])])
+        pending = [self.verbs[0]]
+        while len(pending) > 0:
+            v = pending.pop()
+            if v.terminal == True:
+                continue
+            for follow in v.followers:
+                if id(follow) not in reached:
+                    reached.add(id(follow))
+                    pending.append(follow)
+
+        return VerbList([v for v in self.verbs if id(v) in reached])
+
+    def FindHoistedCalls(self, verbs):
+        """Find the function calls that appear more than once in the verbs'
+        preconditions, so they can be evaluated once per tick instead.
+
+        Calls that use the cue loop's variables, or whose return types aren't
+        in L{nwscript_return_types}, are left alone.  Calls nested in another
+        hoisted call are only hoisted if they still appear more than once
+        outside of it.
+        @param verbs: The verbs whose preconditions end up in the cue loop.
+        @type verbs: list of L{Verb}s
+        @return: The hoisted calls, as C{(call, local name, type)} tuples, in the
+            order the locals should be declared.  A call nested in another
+            hoisted call comes before it, and the outer call is written in
+            terms of the inner call's local, so it is only evaluated once.
+        @rtype: tuple of tuples
+        """
+        counts = {}
+        order = []
+        for v in verbs:
+            for call in v.GetPreconditionCalls():
+                if call in counts:
+                    counts[call] += 1
+                else:
+                    counts[call] = 1
+                    order.append(call)
+
+        # Consider the longest calls first, so we know which calls are nested
+        # in hoisted calls.
+        candidates = [call for call in order if counts[call] > 1]
+        candidates.sort(key=len, reverse=True)
+
+        loop_variables = frozenset(["iVerb", "c_ix", "c_max"])
+        hoisted = []
+        for call in candidates:
+            type = nwscript_return_types.get(call[:call.find("(")].strip())
+            if type is None:
+                continue
+            if len(loop_variables.intersection(identifier_re.findall(call))) > 0:
+                continue
+
+            # A call nested in a hoisted call is only evaluated once there.
+            count = counts[call]
+            for outer, outer_type in hoisted:
+                nested = FindCalls(outer).count(call)
+                count -= nested * (counts[outer] - 1)
+            if count > 1:
+                hoisted.append((call, type))
+
+        # Declare the locals in the order the calls first appear, except that
+        # the calls nested in a call are declared before it.
+        positions = dict([(call, ix) for ix, call in enumerate(order)])
+        hoisted.sort(key=lambda h: positions[h[0]])
+        types = dict(hoisted)
+        declared = []
+        def Declare(call):
+            if call in declared:
+                return
+            for inner in FindCalls(call)[1:]:
+                if inner in types:
+                    Declare(inner)
+            declared.append(call)
+        for call, type in hoisted:
+            Declare(call)
+
+        locals_list = []
+        for call in declared:
+            type = types[call]
+            local = "%sPrecondition%d" % (type_prefixes[type], len(locals_list)+1)
+            locals_list.append((SubstituteHoisted(call, tuple(locals_list)), local, type))
+        return tuple(locals_list)
+
+    def AllocateVerbIds(self):
+        """Give an ID to each verb that doesn't have a usable one.
+
+        Verbs keep the IDs they already have, so deleting, adding or
+        reordering verbs does not change the constants of the other verbs.
+        A verb's ID is replaced if it is missing, is shared with an earlier
+        verb, or no longer matches the verb's type (followers are even,
+        supporters are odd).  New IDs are the lowest free ones of the
+        right type, so IDs freed by deleted verbs are reused.
+        """
+        used = {}
+        unassigned = []
+        for verb in self.verbs:
+            verb_id = verb.verb_id
+            if verb_id is None or verb_id <= 0 or verb_id in used \
+               or (verb_id % 2 == 0) != (verb.follower == True):
+                unassigned.append(verb)
+            else:
+                used[verb_id] = verb
+
+        for verb in unassigned:
+            if verb.follower == True:
+                verb_id = 2 # Followers are even, and there is no ID of 0
+            else:
+                verb_id = 1 # Supporters are odd
+            while verb_id in used:
+                verb_id += 2
+            used[verb_id] = verb
+            verb.verb_id = verb_id
+
     def GenerateZBCode(self):
         """Generate the code for z_b_<behaviour> files.
         @return: The generated NWScript code.
         @rtype: string
         """
-        # Get the variables that we'll need in our generated code.
-        lower_name = self.name.lower()
-        upper_name = self.name.capitalize()
+        return self.__GetZBTemplate().Render(self.__GetZBSections())
 
-        z_b_code = """\
-/* CODE GENERATED BY BEHAVIOUR TOOL */
+    def GenerateBCode(self):
+        """Generate the code for b_<behaviour> files.
+        @return: The generated NWScript code.
+        @rtype: string
+        """
+        return b_template.Render(self.__GetBSections())
 
-#include \"b_%(lower_name)s\"
+    def WriteZBCode(self, stream):
+        """Write the code for z_b_<behaviour> files to a file-like object.
+        @param stream: Where the code is written; only its C{write} method is used.
+        @type stream: file
+        """
+        self.__GetZBTemplate().Write(stream, self.__GetZBSections())
 
-// main will be called by a verb when it has been completed, through ExecuteScript.
-void main()
-{
-    int iBehaviour = GetLocalInt(GetModule(), \"curr_behaviour\");
-    int iReturn = getVerbReturn(iBehaviour);
-    int iVerb = getVerbFinished(iBehaviour);
+    def WriteBCode(self, stream):
+        """Write the code for b_<behaviour> files to a file-like object.
 
-    if (iReturn == SUCCESS)
-    {
-        control_%(upper_name)s(iBehaviour, iVerb);
-    }
-    else
+        The code is written out section by section, and the verb sections
+        verb by verb, so the whole script is never held in memory at once.
+        @param stream: Where the code is written; only its C{write} method is used.
+        @type stream: file
+        """
+        b_template.Write(stream, self.__GetBSections())
+
+    def __GetZBTemplate(self):
+        """Get the shell for the z_b_ script.
+        @return: The shell that finds the behaviour through its object with
+            L{direct_completion}, or the usual one.
+        @rtype: L{Template}
+        """
+        if self.direct_completion == True:
+            return z_b_queue_template
+        return z_b_template
+
+    def __GetZBSections(self):
+        """Get the code for each section of the z_b_ shell.
+        @return: The code for each section, keyed by section name.
+        @rtype: dict
+        """
+        # Get the variables that we'll need in our generated code.
+        lower_name = self.name.lower()
+        upper_name = self.name.capitalize()
+
+        # // A behaviour that paused this one has finished, so carry on.
+        if self.suspend_paused == True:
+            resume_check = """
+    // A behaviour that paused this one has finished, so carry on.  It
+    // leaves the ID on the behaviour object this script is run on.
+    int iResume = GetLocalInt(OBJECT_SELF, \"b_resume\");
+    if (iResume)
     {
-        timeout_%(upper_name)s(iBehaviour);
+        DeleteLocalInt(OBJECT_SELF, \"b_resume\");
+        resume_%s(iResume, 0);
+        return;
     }
-}"""    % {'lower_name':lower_name, 'upper_name':upper_name}
-        
-        return z_b_code
 
-    def GenerateBCode(self):
-        """Generate the code for b_<behaviour> files.
-        @return: The generated NWScript code.
+""" % (upper_name)
+        else:
+            resume_check = ""
+
+        # count_<behaviour name capitalized>(iBehaviour, -1);
+        # (drain_<behaviour name capitalized> counts queued completions.)
+        if self.pool_size > 0 and self.direct_completion == False:
+            verb_count = "    count_%s(iBehaviour, -1);\n" % (upper_name)
+        else:
+            verb_count = ""
+
+        return {'lower_name':lower_name, 'upper_name':upper_name, 'resume_check':resume_check,
+                'verb_count':verb_count}
+
+    def __GetLoaderCall(self, upper_name, locals_list, mask):
+        """Get the code that fetches a function's actors and variables through the shared loader.
+        @param upper_name: The behaviour's name with the first letter capitalized.
+        @type upper_name: string
+        @param locals_list: One line declaring each variable the function uses.
+        @type locals_list: list of strings
+        @param mask: The loader mask selecting those variables.
+        @type mask: int
+        @return: The code to put at the top of the function.
         @rtype: string
         """
+        if len(locals_list) == 0:
+            return "    // This function doesn't use any of the actors or variables."
+
+        lines = ["    // Get the actors and other variables this function uses from the behaviour object.",
+                 "    struct locals_%s lLocals = load_%s(iBehaviour, %d);" % (upper_name, upper_name, mask)]
+        lines.extend(locals_list)
+        return '\n'.join(lines)
+
+    def __GetBSections(self):
+        """Get the code for each section of the b_ shell.
+
+        Every section is collected in a single pass over the variables,
+        and a single pass over the verbs.  The larger sections are left as
+        lists of chunks (see L{Chunks}) so they can be written out without
+        joining them first.
+        @return: The code for each section, keyed by section name.
+        @rtype: dict
+        """
         # Get the strings that we will need to plug into our shell
         
         # <behaviour name all lowercase>
@@ -145,403 +1099,652 @@ void main()
         # Fight
         upper_name = self.name.capitalize()
 
-        # VERBx: <context_name> <actual_name> <follower> <terminal>
-        #     VERBx_PRECONDITIONS: <preconditions seperated by ;;>
-        #     VERBx_FOLLOWERS: <followers seperated by spaces>
-        #     VERBx_VERBDATA: <vdarguments seperated by spaces>
-        #     VERBx_ARGUMENTS: <varguments seperated by ;;>
-        # e.g.:
-        # VERB1: instigate FaceAndSayLine Follower 
-        #     VERB1_FOLLOWERS: retaliate callforhelp 
-        #     VERB1_VERBDATA: oInstigator oVictim 
-        #     VERB1_ARGUMENTS: "Hey punk!  It's fightin' time!"
+        # Make sure every verb has an ID before we write out the constants.
+        self.AllocateVerbIds()
+
+        # Verb sections.  Each verb caches its own header lines and switch
+        # cases, so only verbs that have changed since the last time have to
+        # be generated again.
         verb_info_list = []
-        for ix, v in enumerate(self.verbs):
-            if v.follower == True:
-                follow_text = "Follower"
+        constants_list = []
+        checkcues_switch_list = []
+        control_switch_list = []
+        checkcues_keys = []
+        control_keys = []
+        checkcues_used = set()
+        dropped_verbs = []
+
+        if self.eliminate_dead_verbs == True:
+            live_verbs = self.FindReachableVerbs()
+        else:
+            live_verbs = self.verbs
+
+        if self.hoist_preconditions == True:
+            hoisted = self.FindHoistedCalls(live_verbs)
+        else:
+            hoisted = ()
+
+        # Each verb's cue bit is its position among the verbs that make it
+        # into the script.  Firing a follower clears every follower's bit.
+        if self.bitset_cues == True:
+            follower_masks = CueMasks([ix for ix, v in enumerate(live_verbs) if v.follower == True])
+        checkcues_bits = None
+        control_masks = None
+
+        # A pooled object keeps count of its running verbs (see release_).
+        if self.pool_size > 0:
+            counter = "count_" + upper_name
+        else:
+            counter = None
+
+        for index, v in enumerate(self.verbs):
+            # VERBx: <context_name> <actual_name> <follower> <terminal>
+            #     VERBx_ID: <verb_id>
+            #     VERBx_PRECONDITIONS: <preconditions seperated by ;;>
+            #     VERBx_FOLLOWERS: <followers seperated by spaces>
+            #     VERBx_VERBDATA: <vdarguments seperated by spaces>
+            #     VERBx_ARGUMENTS: <varguments seperated by ;;>
+            #     VERBx_EVENTS: <events seperated by spaces>
+            # e.g.:
+            # VERB1: instigate FaceAndSayLine Follower 
+            #     VERB1_ID: 2
+            #     VERB1_FOLLOWERS: retaliate callforhelp 
+            #     VERB1_VERBDATA: oInstigator oVictim 
+            #     VERB1_ARGUMENTS: "Hey punk!  It's fightin' time!"
+            verb_info_list.append(v.GenerateInfo(index+1))
+
+            if live_verbs is not self.verbs and v not in live_verbs:
+                dropped_verbs.append(v)
+                continue
+
+            # const int <constant_name> = <id>
+            # e.g.:
+            # const int F_INSTIGATE_28 = 2
+            constants_list.append("const int %s = %d" % (v.constant_name, v.verb_id))
+
+            # case <constant_name>:
+            #         <verb's generated checkcues code>
+            #         break;
+            # e.g.:
+            # case F_INSTIGATE_28:
+            #     ...
+            #     break;
+            if self.bitset_cues == True:
+                position = live_verbs.IndexOf(v)
+                if v.follower == True:
+                    checkcues_bits = (position, follower_masks)
+                else:
+                    checkcues_bits = (position, CueMasks([position]))
+                control_masks = CueMasks([live_verbs.IndexOf(follow) for follow in v.followers if follow in live_verbs])
+
+            if self.order_preconditions == True and len(v.preconditions) > 1:
+                ordered = OrderPreconditions(v.preconditions, self.precondition_timings, hoisted)
             else:
-                follow_text = "Supporter"
+                ordered = None
 
-            if v.terminal == True:
-                terminal_text = "Terminal"
+            checkcues_switch_list.append(v.GenerateCheckcuesCase(hoisted, self.event_driven, checkcues_bits, ordered, counter))
+            if self.bitset_cues == True:
+                checkcues_keys.append((position, str(position)))
             else:
-                terminal_text = ""
-
-            verb_info_list.append("VERB%d: %s %s %s %s" % (ix+1, v.context_name, v.actual_name, follow_text, terminal_text))
-
-            if len(v.preconditions) > 0:
-                precond_text = "    VERB%d_PRECONDITIONS: " % (ix+1)
-                for precond in v.preconditions:
-                    precond_text += (precond + ";; ")
-                verb_info_list.append(precond_text[:-3])
-
-            if v.terminal == False:
-                followers_text = "    VERB%d_FOLLOWERS: " % (ix+1)
-                for follow in v.followers:
-                    followers_text += (follow.context_name + ' ')
-                verb_info_list.append(followers_text)
-
-            vdargs_text = "    VERB%d_VERBDATA: " % (ix+1)
-            for vdarg in v.vdarguments:
-                vdargs_text += (vdarg + ' ')
-            verb_info_list.append(vdargs_text)
-
-            if len(v.varguments) > 0:
-                vargs_text = "    VERB%d_ARGUMENTS: " % (ix+1)
-                for varg in v.varguments:
-                    vargs_text += (varg + ";; ")
-                verb_info_list.append(vargs_text[:-3])
-        verb_info = '\n'.join(verb_info_list)
-
-        # ACTORx: <type> <name> <description>
-        # e.g.:
-        # ACTOR1: object oInstigator The instigator starts the fight.
+                checkcues_keys.append((v.verb_id, v.constant_name))
+
+            # case <constant_name>:
+            #         <verb's generated control code>
+            #         break;
+            # e.g.:
+            # case F_INSTIGATE_28:
+            #     ...
+            #     break;
+            control_switch_list.append(v.GenerateControlCase(control_masks))
+            control_keys.append((v.verb_id, v.constant_name))
+
+            if self.shared_loader == True:
+                checkcues_used.update(v.GetIdentifiers())
+
+        # Variable sections.  Actors show up in every section, while plain
+        # variables are left out of those dealing with checking actors in and out.
         actor_info_list = []
-        ix = 1
-        for actor in self.nwvariables:
-            if actor.isActor == True:
-                actor_info_list.append("ACTOR%d: %s %s %s" % (ix, actor.type, actor.name, actor.description))
-                ix += 1
-        actor_info = '\n'.join(actor_info_list)
-
-        # VARIABLEx: <type> <name> <description>
-        # e.g.:
-        # VARIABLE1: string sConv The conversation file to be run
         nwvar_info_list = []
-        ix = 1
-        for nwvar in self.nwvariables:
-            if nwvar.isActor == False:
-                nwvar_info_list.append("VARIABLE%d: %s %s %s" % (ix, nwvar.type, nwvar.name, nwvar.description))
-                ix += 1
-        nwvar_info = '\n'.join(nwvar_info_list)
-
-        # const int <constant_name> = <id>
-        # e.g.:
-        # const int F_INSTIGATE_28 = 2
-        constants_list = []
-        for index, v in enumerate(self.verbs):
-            if (v.follower == True):
-                id = (index*2)+2 # + 2 to prevent an ID of 0
-            else:
-                id = (index*2)+1 # + 1 to make supporters odd
-            constants_list.append("const int %s = %d" % (v.constant_name, id))
-        constants = '\n'.join(constants_list)
-
-        # //  <name> - <description>
-        # e.g.:
-        # //  oInstigator - The instigator starts the fight.
         nwvar_comments_list = []
-        for nwvar in self.nwvariables:
-            nwvar_comments_list.append("//  %s - %s" % (nwvar.name, nwvar.description))
-        nwvar_comments = '\n'.join(nwvar_comments_list)
-
-        # , <type> <name>
-        # e.g.:
-        # , object oInstigator, object oVictim, string sConv
         nwvar_list = []
-        for nwvar in self.nwvariables:
-            nwvar_list.append(", %s %s" % (nwvar.type, nwvar.name))
-        nwvars = ''.join(nwvar_list)
-        
-        # <name> != <invalid value>
-        # e.g.:
-        # oInstigator != OBJECT_INVALID && oVictim != OBJECT_INVALID && sConv != ""
         invalids_list = []
-        for nwvar in self.nwvariables:
-            invalids_list.append("%s != %s" % (nwvar.name, nwvar.GetInvalidValue()))
-        invalids = " && ".join(invalids_list)
-
-        # b_Checkout(<name>, iID, iInterrupt)
-        # e.g.:
-        # b_Checkout(oInstigator, iID, iInterrupt) && b_Checkout(oVictim, iID, iInterrupt)
         checkout_list = []
-        for nwvar in self.nwvariables:
-            if nwvar.isActor == True:
-                checkout_list.append("b_Checkout(%s, iID, iInterrupt)" % (nwvar.name))
-        checkouts = " && ".join(checkout_list)
-
-        # <first verb constant_name>
-        # e.g.:
-        # F_INSTIGATE_28
-        if len(self.verbs) > 0:
-            firstverb_name = self.verbs[0].constant_name
-        else:
-            firstverb_name = ""
-
-        # SetLocal<type>(o<behaviour name capitalized>, "<name>", <name>);
-        # e.g.:
-        # SetLocalObject(oFight, "oInstigator", oInstigator);
-        # SetLocalObject(oFight, "oVictim", oVictim);
-        # SetLocalString(oFight, "sConv", sConv);
         setlocal_list = []
-        for nwvar in self.nwvariables:
-            setlocal_list.append("            SetLocal%s(o%s, \"%s\", %s);" % (nwvar.type.capitalize(), upper_name, nwvar.name, nwvar.name))
-        setlocals = '\n'.join(setlocal_list)
-
-        # <type> <name> = GetLocal<type>(o<behaviour name capitalized>, "<name>");
-        # e.g.:
-        # // Get the actors and other variables from the behaviour object.
-        # object oInstigator = GetLocalObject(oFight, "oInstigator");
-        # object oVictim = GetLocalObject(oFight, "oVictim");
-        # string sConv = GetLocalString(oFight, "sConv");
         getlocals_list = ["    // Get the actors and other variables from the behaviour object."]
-        for nwvar in self.nwvariables:
-            getlocals_list.append("    %s %s = GetLocal%s(o%s, \"%s\");" % (nwvar.type, nwvar.name, nwvar.type.capitalize(), upper_name, nwvar.name))
-        getlocals = '\n'.join(getlocals_list)
+        loader_members_list = []
+        loader_list = []
+        checkcues_locals_list = []
+        checkcues_mask = 0
+        cleanup_locals_list = []
+        cleanup_mask = 0
+        all_locals_list = []
+        all_mask = 0
+        segue_previous_list = []
+        checkin_list = []
+        pool_resets_list = []
 
-        # case <constant_name>:
-        #         <verb's generated checkcues code>
-        #         break;
-        # e.g.:
-        # case F_INSTIGATE_28:
-        #     ...
-        #     break;
-        # case F_RETALIATE_G8:
-        #     ...
-        #     break;
-        # case S_CALLFORHELP_29:
-        #     ...
-        #     break;
-        checkcues_switch_list = []
-        for v in self.verbs:
-            checkcues_switch_list.append("        case %s:\n%s\n            break;" % (v.constant_name, v.GenerateCheckcuesCode()))
-        checkcues_switch = '\n'.join(checkcues_switch_list)
+        for index, nwvar in enumerate(self.nwvariables):
+            name = nwvar.name
+            type = nwvar.type
+            local_type = type.capitalize()
 
-        # case <constant_name>:
-        #         <verb's generated control code>
-        #         break;
-        # e.g.:
-        # case F_INSTIGATE_28:
-        #     ...
-        #     break;
-        # case F_RETALIATE_G8:
-        #     ...
-        #     break;
-        # case S_CALLFORHELP_29:
-        #     ...
-        #     break;
-        control_switch_list = []
-        for v in self.verbs:
-            control_switch_list.append("    case %s:\n%s\n        break;" % (v.constant_name, v.GenerateControlCode()))
-        control_switch = '\n'.join(control_switch_list)
-
-        # iPrevious = b_GetPausedBehaviour(<name>);
-        # if (iPrevious)
-        # {
-        #     setSegueToBehaviour(iPrevious, TRUE);
-        # }
-        # e.g.:
-        # iPrevious = b_GetPausedBehaviour(oInstigator);
-        # if (iPrevious)
-        # {
-        #     setSegueToBehaviour(iPrevious, TRUE);
-        # }
-        # 
-        # iPrevious = b_GetPausedBehaviour(oVictim);
-        # if (iPrevious)
-        # {
-        #     setSegueToBehaviour(iPrevious, TRUE);
-        # }
-        segue_previous_list = []
-        for nwvar in self.nwvariables:
             if nwvar.isActor == True:
+                # ACTORx: <type> <name> <description>
+                # e.g.:
+                # ACTOR1: object oInstigator The instigator starts the fight.
+                actor_info_list.append("ACTOR%d: %s %s %s" % (len(actor_info_list)+1, type, name, nwvar.description))
+
+                # b_Checkout(<name>, iID, iInterrupt)
+                # e.g.:
+                # b_Checkout(oInstigator, iID, iInterrupt)
+                checkout_list.append("b_Checkout(%s, iID, iInterrupt)" % (name))
+
+                # iPrevious = b_GetPausedBehaviour(<name>);
+                # if (iPrevious)
+                # {
+                #     setSegueToBehaviour(iPrevious, TRUE);
+                #     <wake it up if it is suspended>
+                # }
+                if self.suspend_paused == True:
+                    wake = """
+
+            // Wake it up if it stopped its heartbeat while it was paused.
+            oPrevious = getBehaviourObject(iPrevious);
+            if (GetLocalInt(oPrevious, "iSuspended"))
+            {
+                SetLocalInt(oPrevious, "b_resume", iPrevious);
+                ExecuteScript(GetLocalString(oPrevious, "sScript"), oPrevious);
+            }"""
+                else:
+                    wake = ""
                 segue_previous_list.append("""\
         iPrevious = b_GetPausedBehaviour(%s);
         if (iPrevious)
         {
-            setSegueToBehaviour(iPrevious, TRUE);
-        }""" % (nwvar.name))
-        segue_previous = "\n\n".join(segue_previous_list)
+            setSegueToBehaviour(iPrevious, TRUE);%s
+        }""" % (name, wake))
 
-        # b_Checkin(<name>);
-        # e.g.:
-        # b_Checkin(oInstigator);
-        # b_Checkin(oVictim);
-        checkin_list = []
-        for nwvar in self.nwvariables:
-            if nwvar.isActor == True:
-                checkin_list.append("    b_Checkin(%s);" % (nwvar.name))
-        checkin = '\n'.join(checkin_list)
+                # b_Checkin(<name>);
+                # e.g.:
+                # b_Checkin(oInstigator);
+                checkin_list.append("    b_Checkin(%s);" % (name))
+            else:
+                # VARIABLEx: <type> <name> <description>
+                # e.g.:
+                # VARIABLE1: string sConv The conversation file to be run
+                nwvar_info_list.append("VARIABLE%d: %s %s %s" % (len(nwvar_info_list)+1, type, name, nwvar.description))
 
-        # Generate the code
-        
-        b_code = """\
-/* CODE GENERATED BY BEHAVIOUR TOOL
-Don't delete this comment block! You can, however, modify the elements.  Changes will show up when you reload the file.
-BEHAVIOUR: %(upper_name)s
-%(verb_info)s
-%(actor_info)s
-%(nwvar_info)s
- */
-        
-#include \"util_bintarray\"
-#include \"util_behaviour\"
-#include \"util_verbs\"
+            # //  <name> - <description>
+            # e.g.:
+            # //  oInstigator - The instigator starts the fight.
+            nwvar_comments_list.append("//  %s - %s" % (name, nwvar.description))
 
-/////////// Constants ///////////
-%(constants)s
+            # , <type> <name>
+            # e.g.:
+            # , object oInstigator
+            nwvar_list.append(", %s %s" % (type, name))
 
-/////////// Declarations ///////////
+            # <name> != <invalid value>
+            # e.g.:
+            # oInstigator != OBJECT_INVALID
+            invalids_list.append("%s != %s" % (name, nwvar.GetInvalidValue()))
 
-// Initializes the %(upper_name)s behaviour.
-%(nwvar_comments)s
-int start_%(upper_name)s(int iTimeout, int iInterrupt%(nwvars)s);
-void checkcues_%(upper_name)s(int iTimeout, int iBehaviour);
-void control_%(upper_name)s(int iBehaviour, int iVerb);
-void cleanup_%(upper_name)s(int iBehaviour);
-void timeout_%(upper_name)s(int iBehaviour);
-void segue_%(upper_name)s(int iBehaviour);
+            # SetLocal<type>(o<behaviour name capitalized>, "<name>", <name>);
+            # e.g.:
+            # SetLocalObject(oFight, "oInstigator", oInstigator);
+            setlocal_list.append("            SetLocal%s(o%s, \"%s\", %s);" % (local_type, upper_name, name, name))
 
-/////////// Implementations ///////////
+            # The event hooks find the behaviour through its actors.
+            # SetLocalInt(<name>, "b_<behaviour name all lowercase>", iID);
+            # DeleteLocalInt(<name>, "b_<behaviour name all lowercase>");
+            # e.g.:
+            # SetLocalInt(oInstigator, "b_fight", iID);
+            # DeleteLocalInt(oInstigator, "b_fight");
+            if self.event_driven == True and nwvar.isActor == True:
+                setlocal_list.append("            SetLocalInt(%s, \"b_%s\", iID);" % (name, lower_name))
+                checkin_list.append("    DeleteLocalInt(%s, \"b_%s\");" % (name, lower_name))
 
-int start_%(upper_name)s(int iTimeout, int iInterrupt%(nwvars)s)
-{
-    // Make sure we have have what we need to start the behaviour.
-    if (%(invalids)s)
-    {
-        object o%(upper_name)s = createBehaviourObject();
-        int iID = GetLocalInt(o%(upper_name)s, \"ID\");
-
-        // Check out our actors.
-        if (%(checkouts)s)
-        {
-            // Set necessary parameters on the behaviour object.
-%(setlocals)s
-            SetLocalInt   (o%(upper_name)s, \"iInterrupt\", iInterrupt);
-            SetLocalString(o%(upper_name)s, \"sScript\", \"z_b_%(lower_name)s\");
-
-            // Set up the cue array and add the first step to it.
-            intarrayNew(o%(upper_name)s, \"cues\");
-            addCue(iID, %(firstverb_name)s);
+            # <type> <name> = GetLocal<type>(o<behaviour name capitalized>, "<name>");
+            # e.g.:
+            # object oInstigator = GetLocalObject(oFight, "oInstigator");
+            getlocals_list.append("    %s %s = GetLocal%s(o%s, \"%s\");" % (type, name, local_type, upper_name, name))
 
-            checkcues_%(upper_name)s(iTimeout, iID);
+            # DeleteLocal<type>(oPooled, "<name>");
+            # e.g.:
+            # DeleteLocalObject(oPooled, "oInstigator");
+            pool_resets_list.append("    DeleteLocal%s(oPooled, \"%s\");" % (local_type, name))
+
+            if self.shared_loader == True:
+                # The first 31 variables each get a bit in the loader's mask;
+                # any beyond that are always fetched.
+                if index < 31:
+                    bit = 1 << index
+                    loader_list.append("    if (iMask & %d)\n        lLocals.%s = GetLocal%s(o%s, \"%s\");" % (bit, name, local_type, upper_name, name))
+                else:
+                    bit = 0
+                    loader_list.append("    lLocals.%s = GetLocal%s(o%s, \"%s\");" % (name, local_type, upper_name, name))
+                loader_members_list.append("    %s %s;" % (type, name))
+
+                # <type> <name> = lLocals.<name>;
+                # e.g.:
+                # object oInstigator = lLocals.oInstigator;
+                local = "    %s %s = lLocals.%s;" % (type, name, name)
+                if name in checkcues_used:
+                    checkcues_locals_list.append(local)
+                    checkcues_mask |= bit
+                if nwvar.isActor == True:
+                    cleanup_locals_list.append(local)
+                    cleanup_mask |= bit
+                all_locals_list.append(local)
+                all_mask |= bit
+
+        # // Unreachable verbs left out: <context names seperated by spaces>
+        # e.g.:
+        # // Unreachable verbs left out: taunt flee
+        self.dropped_verbs = dropped_verbs
+        if len(dropped_verbs) > 0:
+            constants_list.append("\n// Unreachable verbs left out: %s" % \
+                                  " ".join([v.context_name for v in dropped_verbs]))
 
-            return iID;
-        }
-    }
+        # <first verb constant_name>
+        # e.g.:
+        # F_INSTIGATE_28
+        if len(self.verbs) > 0:
+            firstverb_name = self.verbs[0].constant_name
+        else:
+            firstverb_name = ""
 
-    return FALSE;
-}
+        # // Evaluate the preconditions shared between verbs once per tick.
+        # <type> <local name> = <call>;
+        # e.g.:
+        # object oPrecondition1 = GetNearestCreature(CREATURE_TYPE_ALIVE, TRUE, 2);
+        if len(hoisted) > 0:
+            hoisted_list = ["    // Evaluate the calls shared between the verbs' preconditions once per tick."]
+            for call, local, type in hoisted:
+                hoisted_list.append("    %s %s = %s;" % (type, local, call))
+            hoisted_locals = '\n'.join(hoisted_list) + "\n\n"
+        else:
+            hoisted_locals = ""
 
-void checkcues_%(upper_name)s(int iTimeout, int iBehaviour)
+        # OPTIONS: <options seperated by spaces>
+        # e.g.:
+        # OPTIONS: shared_loader
+        options = self.GetOptions()
+        if len(options) > 0:
+            options_info = "\nOPTIONS: " + " ".join(options)
+        else:
+            options_info = ""
+
+        if self.shared_loader == True and len(self.nwvariables) > 0:
+            unused = "    // This function doesn't use any of the actors or variables."
+            checkcues_locals = self.__GetLoaderCall(upper_name, checkcues_locals_list, checkcues_mask)
+            control_locals = unused
+            cleanup_locals = self.__GetLoaderCall(upper_name, cleanup_locals_list, cleanup_mask)
+            # Authors can use every actor and variable in these two, and
+            # they seldom run, so they fetch them all.
+            timeout_locals = self.__GetLoaderCall(upper_name, all_locals_list, all_mask)
+            segue_locals = timeout_locals
+            loader_declaration = """
+
+// The actors and variables of the %(upper_name)s behaviour, as fetched by load_%(upper_name)s.
+struct locals_%(upper_name)s
 {
-%(getlocals)s
-
-    // Are we finished?
-    if (getBehaviourFinished(iBehaviour))
-    {
-        cleanup_%(upper_name)s(iBehaviour);
-        return;
-    }
-
-    // Check to see if we want to segue before we check if we're paused.
-    if (getSegueToBehaviour(iBehaviour))
-    {
-        segue_%(upper_name)s(iBehaviour);
-        setSegueToBehaviour(iBehaviour, FALSE);
-        setBehaviourPaused(iBehaviour, FALSE);
-        DelayCommand(2*DEFAULT_HEARTBEAT_DELAY, checkcues_%(upper_name)s(iTimeout, iBehaviour));
-        return;
-    }
-
-    // If we're paused, we'll just idle (no need to check as often as usual).
-    if (getBehaviourPaused(iBehaviour))
-    {
-        DebugPrint(\"%(upper_name)s paused...\");
-        DelayCommand(4*DEFAULT_HEARTBEAT_DELAY, checkcues_%(upper_name)s(iTimeout, iBehaviour));
-        return;
-    }
-
-    // Have we timed out?
-    if (!iTimeout)
-    {
-        timeout_%(upper_name)s(iBehaviour);
-        DelayCommand(DEFAULT_HEARTBEAT_DELAY, checkcues_%(upper_name)s(iTimeout, iBehaviour));
-        return;
-    }
-
-    // Run through each cue and see if any of them fire
-    int c_ix, c_max, iVerb;
-
-    c_max = getNumCues(iBehaviour);
-
-    for (c_ix = 0; c_ix < c_max; c_ix++)
-    {
-        iVerb = getNextCue(iBehaviour);
-        DebugPrint(\"Checking verb \" + IntToString(iVerb));
-
-        switch (iVerb)
-        {
-%(checkcues_switch)s
-        }
-    }
-
-    DelayCommand(DEFAULT_HEARTBEAT_DELAY, checkcues_%(upper_name)s(iTimeout-1, iBehaviour));
-
-    DebugPrint(\"%(upper_name)s \" + IntToString(iBehaviour) + \" tick...\");
-}
-
-void control_%(upper_name)s(int iBehaviour, int iVerb)
+%(members)s
+};
+
+struct locals_%(upper_name)s load_%(upper_name)s(int iBehaviour, int iMask);""" % {"upper_name":upper_name, "members":'\n'.join(loader_members_list)}
+            loader = """
+// Gets the actors and variables of the %(upper_name)s behaviour from the
+// behaviour object.  Only the variables whose bits are set in iMask
+// are fetched; the rest are left at their defaults.
+struct locals_%(upper_name)s load_%(upper_name)s(int iBehaviour, int iMask)
 {
-%(getlocals)s
-
-    switch (iVerb)
-    {
-%(control_switch)s
-    }
+    struct locals_%(upper_name)s lLocals;
+%(loader)s
+    return lLocals;
 }
+""" % {"upper_name":upper_name, "loader":'\n'.join(loader_list)}
+        else:
+            getlocals = '\n'.join(getlocals_list)
+            checkcues_locals = getlocals
+            control_locals = getlocals
+            cleanup_locals = getlocals
+            timeout_locals = getlocals
+            segue_locals = getlocals
+            loader_declaration = ""
+            loader = ""
+
+        sections = {"lower_name":lower_name,
+                "upper_name":upper_name,
+                "options_info":options_info,
+                "verb_info":Chunks(verb_info_list, '\n'),
+                "actor_info":'\n'.join(actor_info_list),
+                "nwvar_info":'\n'.join(nwvar_info_list),
+                "constants":'\n'.join(constants_list),
+                "nwvar_comments":'\n'.join(nwvar_comments_list),
+                "nwvars":''.join(nwvar_list),
+                "invalids":" && ".join(invalids_list),
+                "checkouts":" && ".join(checkout_list),
+                "setlocals":'\n'.join(setlocal_list),
+                "checkcues_locals":checkcues_locals,
+                "control_locals":control_locals,
+                "cleanup_locals":cleanup_locals,
+                "timeout_locals":timeout_locals,
+                "segue_locals":segue_locals,
+                "loader_declaration":loader_declaration,
+                "loader":loader,
+                "firstverb_name":firstverb_name,
+                "hoisted_locals":hoisted_locals,
+                "control_dispatch":GetDispatch("iVerb", \
+                    [key + (case,) for key, case in zip(control_keys, control_switch_list)], 1, self.dispatch_threshold),
+                "segue_previous":"\n\n".join(segue_previous_list),
+                "checkin":'\n'.join(checkin_list)}
+
+        if self.bitset_cues == True:
+            # // Set up the cue bits, starting with the first step.
+            # SetLocalInt(o<behaviour name capitalized>, "iCues0", 1);
+            sections["start_cues"] = """\
+            // Set up the cue bits, starting with the first step.
+            SetLocalInt(o%s, "iCues0", 1);""" % (upper_name)
+            sections["cue_count"] = str(len(live_verbs))
+            sections["word_bits"] = str(cue_word_bits)
+            sections["word_skip"] = str(cue_word_bits - 1)
+
+            # The words are compared one at a time; adding them up could
+            # overflow.
+            # int iBackoffCues<word> = GetLocalInt(getBehaviourObject(iBehaviour), "iCues<word>");
+            # GetLocalInt(oBackoff, "iCues<word>") != iBackoffCues<word> || ...
+            words = range(max(1, (len(live_verbs) + cue_word_bits - 1) / cue_word_bits))
+            sections["cue_snapshot"] = ''.join(["    int iBackoffCues%d = GetLocalInt(getBehaviourObject(iBehaviour), \"iCues%d\");\n" % (word, word) \
+                for word in words])
+            sections["cues_fired"] = " || ".join(["GetLocalInt(oBackoff, \"iCues%d\") != iBackoffCues%d" % (word, word) \
+                for word in words])
+            sections["control_locals"] += "\n    object oCues = getBehaviourObject(iBehaviour);"
+        else:
+            sections["start_cues"] = """\
+            // Set up the cue array and add the first step to it.
+            intarrayNew(o%s, "cues");
+            addCue(iID, %s);""" % (upper_name, firstverb_name)
+            sections["cue_snapshot"] = "    int iBackoffCues = getNumCues(iBehaviour);\n"
+            sections["cues_fired"] = "getNumCues(iBehaviour) < iBackoffCues"
+
+        # DebugPrint("<behaviour name> paused...");
+        # DebugPrint("<behaviour name> " + IntToString(iBehaviour) + " tick...");
+        # DebugPrint("Checking verb " + IntToString(iVerb));
+        if self.release_build == True:
+            sections["debug_paused"] = ""
+            sections["debug_tick"] = ""
+            sections["debug_cue"] = ""
+        else:
+            sections["debug_paused"] = "        DebugPrint(\"%s paused...\");\n" % (upper_name)
+            sections["debug_tick"] = "\n    DebugPrint(\"%s \" + IntToString(iBehaviour) + \" tick...\");\n" % (upper_name)
+            if self.bitset_cues == True:
+                sections["debug_cue"] = "        DebugPrint(\"Checking cue \" + IntToString(iCue));\n"
+            else:
+                sections["debug_cue"] = "        DebugPrint(\"Checking verb \" + IntToString(iVerb));\n"
 
-void cleanup_%(upper_name)s(int iBehaviour)
-{
-%(getlocals)s
-    int iInterrupt = GetLocalInt(o%(upper_name)s, \"iInterrupt\");
+        # // Check at most <cap> cues per call, to stay under the instruction limit.
+        if self.instruction_budget > 0:
+            cue_limit = self.GetCueLimit(checkcues_switch_list)
+            sections["cue_limit"] = str(cue_limit)
+            sections["cue_limit_info"] = "    // Check at most %d cues per call, to stay under the instruction limit.\n" % (cue_limit)
+        else:
+            sections["cue_limit"] = None
+            sections["cue_limit_info"] = ""
 
-    // If we paused behaviours, we'll segue back into them.
-    if (iInterrupt == INTERRUPT_PAUSE)
+        # void drain_<behaviour name capitalized>(object oQueue, int iBehaviour, int iVerb, int iReturn);
+        if self.direct_completion == True:
+            if counter is not None:
+                verb_count = "        %s(iBehaviour, -1);\n" % (counter)
+            else:
+                verb_count = ""
+            sections["completion_declarations"] = "\nvoid drain_%s(object oQueue, int iBehaviour, int iVerb, int iReturn);" % (upper_name)
+            sections["completion_functions"] = drain_template.Render({"upper_name":upper_name,
+                                                                      "lower_name":lower_name,
+                                                                      "verb_count":verb_count})
+            pool_resets_list.append("    DeleteLocalInt(oPooled, \"iCompletions\");")
+        else:
+            sections["completion_declarations"] = ""
+            sections["completion_functions"] = ""
+
+        # object acquire_<behaviour name capitalized>();
+        # void release_<behaviour name capitalized>(int iBehaviour);
+        if self.pool_size > 0:
+            sections["create_object"] = "acquire_%s()" % (upper_name)
+            sections["destroy_object"] = "release_%s(iBehaviour);" % (upper_name)
+            sections["pool_declarations"] = "\nobject acquire_%s();\nvoid count_%s(int iBehaviour, int iChange);\nvoid release_%s(int iBehaviour);" % (upper_name, upper_name, upper_name)
+
+            pool_resets_list.extend(["    DeleteLocalInt(oPooled, \"iInterrupt\");",
+                                     "    DeleteLocalString(oPooled, \"sScript\");",
+                                     "    DeleteLocalInt(oPooled, \"current_verb\");",
+                                     "    DeleteLocalInt(oPooled, \"v_finished\");"])
+            if self.bitset_cues == True:
+                for word in range(max(1, (len(live_verbs) + cue_word_bits - 1) / cue_word_bits)):
+                    pool_resets_list.append("    DeleteLocalInt(oPooled, \"iCues%d\");" % (word))
+                if self.instruction_budget > 0:
+                    pool_resets_list.append("    DeleteLocalInt(oPooled, \"iCueCursor\");")
+            if self.backoff_idle_ticks > 0:
+                # The heartbeat count carries on, so a wake-up that is still
+                # pending from the last run doesn't go through.
+                for name in ("iBackoffIdle", "iBackoffDelay", "iBackoffWaiting", "iBackoffTimeout", "iBackoffStartHour"):
+                    pool_resets_list.append("    DeleteLocalInt(oPooled, \"%s\");" % (name))
+                pool_resets_list.append("    DeleteLocalFloat(oPooled, \"fBackoffStartSecond\");")
+            if self.scheduled == True:
+                for name in ("iScheduledWait", "iScheduledTimeout"):
+                    pool_resets_list.append("    DeleteLocalInt(oPooled, \"%s\");" % (name))
+            if self.suspend_paused == True:
+                # iSuspensions carries on, so a fallback check still pending
+                # from the last run doesn't go through.
+                pool_resets_list.append("    DeleteLocalInt(oPooled, \"iSuspendedTimeout\");")
+                pool_resets_list.append("    DeleteLocalInt(oPooled, \"b_resume\");")
+
+            sections["pool_functions"] = pool_template.Render({"upper_name":upper_name,
+                                                               "lower_name":lower_name,
+                                                               "pool_size":str(self.pool_size),
+                                                               "finished_local":finished_local,
+                                                               "pool_resets":'\n'.join(pool_resets_list)})
+        else:
+            sections["create_object"] = "createBehaviourObject()"
+            sections["destroy_object"] = "destroyBehaviourObject(iBehaviour);"
+            sections["pool_declarations"] = ""
+            sections["pool_functions"] = ""
+
+        # switch (<iVerb or iCue>) { <cases> } OR if (<iVerb or iCue> < <value>) { ... } else { ... }
+        if self.bitset_cues == True:
+            cue_variable = "iCue"
+        else:
+            cue_variable = "iVerb"
+        sections["checkcues_dispatch"] = GetDispatch(cue_variable, \
+            [key + (case,) for key, case in zip(checkcues_keys, checkcues_switch_list)], 2, self.dispatch_threshold)
+
+        self.__AddCheckcuesSections(sections)
+        return sections
+
+    def GetCueLimit(self, cases):
+        """Work out how many cues can be checked per call within the L{instruction_budget}.
+        @param cases: The cases in the cue loop's switch statement.
+        @type cases: list of strings
+        @return: The number of cues, at least 1.
+        @rtype: int
+        """
+        # Each cue costs the loop's own overhead, a comparison against each
+        # case on the way to its own, and the most expensive case's code.
+        if self.bitset_cues == True:
+            loop = limited_bitset_cue_loop_template
+        else:
+            loop = limited_cue_loop_template
+        compares = len(cases)
+        if self.dispatch_threshold > 0 and compares > self.dispatch_threshold:
+            # One comparison per level of the tree, then the switch at the bottom.
+            size = len(cases)
+            compares = dispatch_leaf_cases
+            while size > dispatch_leaf_cases:
+                size = (size + 1) / 2
+                compares += 1
+        per_cue = EstimateInstructions("".join([literal for literal, section in loop.segments])) + 2*compares
+        if len(cases) > 0:
+            per_cue += max([EstimateInstructions(case) for case in cases])
+        return max(1, self.instruction_budget / per_cue)
+
+    def __GetRequeue(self, upper_name, timeout, ticks):
+        """Get the statement that has C{checkcues_<Behaviour>} called again later.
+        @param upper_name: The behaviour's name with the first letter capitalized.
+        @type upper_name: string
+        @param timeout: The timeout to call it with.
+        @type timeout: string
+        @param ticks: The number of heartbeats to wait.
+        @type ticks: string
+        @return: The NWScript statement.
+        @rtype: string
+        """
+        if self.scheduled == True:
+            return "requeue_%s(iBehaviour, %s, %s);" % (upper_name, timeout, ticks)
+        elif ticks == "1":
+            return "DelayCommand(DEFAULT_HEARTBEAT_DELAY, checkcues_%s(%s, iBehaviour));" % (upper_name, timeout)
+        else:
+            return "DelayCommand(%s*DEFAULT_HEARTBEAT_DELAY, checkcues_%s(%s, iBehaviour));" % (ticks, upper_name, timeout)
+
+    def __AddCheckcuesSections(self, sections):
+        """Add the sections that depend on when the cues are checked; either on
+        every heartbeat, or when events happen (see L{event_driven}), and how
+        often the heartbeat comes around (see L{backoff_idle_ticks}).
+        @param sections: The code for each section of the b_ shell, keyed by
+            section name.  The cue loop's sections must already be filled in.
+        @type sections: dict
+        """
+        upper_name = sections["upper_name"]
+        if self.bitset_cues == True and self.instruction_budget > 0:
+            cue_loop = limited_bitset_cue_loop_template.RenderChunks(sections)
+        elif self.bitset_cues == True:
+            cue_loop = bitset_cue_loop_template.RenderChunks(sections)
+        elif self.instruction_budget > 0:
+            cue_loop = limited_cue_loop_template.RenderChunks(sections)
+        else:
+            cue_loop = cue_loop_template.RenderChunks(sections)
+
+        sections["segue_requeue"] = self.__GetRequeue(upper_name, "iTimeout", "2")
+        if self.suspend_paused == True:
+            # A scheduled behaviour leaves the scheduler while it's suspended.
+            if self.scheduled == True:
+                suspend = """
+        deregister_%s(iBehaviour);""" % (upper_name)
+                register = "\n    register_%s(iBehaviour);" % (upper_name)
+            else:
+                suspend = ""
+                register = ""
+
+            # Each suspension is numbered, so a fallback check that is still
+            # pending after an early wake-up doesn't start a second heartbeat.
+            sections["paused_requeue"] = """\
+// Only check back now and then until the behaviour that paused us
+        // finishes; its cleanup may wake us sooner.
+        object oSuspended = getBehaviourObject(iBehaviour);%s
+        int iSuspended = GetLocalInt(oSuspended, "iSuspensions") + 1;
+        SetLocalInt(oSuspended, "iSuspensions", iSuspended);
+        SetLocalInt(oSuspended, "iSuspended", iSuspended);
+        SetLocalInt(oSuspended, "iSuspendedTimeout", iTimeout);
+        DelayCommand(%d*DEFAULT_HEARTBEAT_DELAY, resume_%s(iBehaviour, iSuspended));""" % (suspend, suspended_poll_ticks, upper_name)
+            sections["resume_declaration"] = "\nvoid resume_%s(int iBehaviour, int iSuspended);" % (upper_name)
+            sections["resume_function"] = resume_template.Render({"upper_name":upper_name, "register":register})
+            sections["previous_object"] = "\n        object oPrevious;"
+        else:
+            sections["paused_requeue"] = self.__GetRequeue(upper_name, "iTimeout", "4")
+            sections["resume_declaration"] = ""
+            sections["resume_function"] = ""
+            sections["previous_object"] = ""
+        sections["timeout_requeue"] = self.__GetRequeue(upper_name, "iTimeout", "1")
+
+        if self.event_driven == False:
+            ticks = 1
+            sections["checkcues_evaluate"] = cue_loop
+            sections["checkcues_reschedule"] = "    " + self.__GetRequeue(upper_name, "iTimeout-1", "1")
+            sections["checkcues_functions"] = []
+            sections["checkcues_declarations"] = ""
+            sections["control_evaluate"] = ""
+        else:
+            # The cue loop moves to evaluate_<Behaviour>, along with the variables it uses.
+            values = {"upper_name":upper_name,
+                      "lower_name":sections["lower_name"],
+                      "evaluate_locals":sections["checkcues_locals"],
+                      "cue_loop":cue_loop}
+            sections["checkcues_locals"] = "    // This function doesn't use any of the actors or variables."
+
+            sections["checkcues_evaluate"] = """\
+    // Check every cue; events will check them again in between polls.
+    evaluate_%s(iBehaviour, %d);""" % (upper_name, all_events)
+
+            # Count the skipped ticks against the timeout, and poll early
+            # rather than skip past it (negative timeouts never run out).
+            ticks = self.event_poll_ticks
+            sections["checkcues_reschedule"] = """\
+    // Only poll every so often; the events take care of the rest.  A
+    // timeout that runs out sooner cuts the wait short.
+    int iPollTicks = %(ticks)d;
+    if (iTimeout > 0)
     {
-        int iPrevious;
-        
-%(segue_previous)s
+        if (iTimeout < iPollTicks)
+        {
+            iPollTicks = iTimeout;
+        }
+        iTimeout -= iPollTicks - 1;
     }
-
-%(checkin)s
-    destroyBehaviourObject(iBehaviour);
-}
-
-void timeout_%(upper_name)s(int iBehaviour)
-{
-%(getlocals)s
-
-    // Insert timeout handling code here
-
-    setBehaviourFinished(iBehaviour);
-}
-
-void segue_%(upper_name)s(int iBehaviour)
-{
-%(getlocals)s
-
-    // Insert segue handling code here
-}
-""" %   {"lower_name":lower_name,
-         "upper_name":upper_name,
-         "verb_info":verb_info,
-         "actor_info":actor_info,
-         "nwvar_info":nwvar_info,
-         "constants":constants,
-         "nwvar_comments":nwvar_comments,
-         "nwvars":nwvars,
-         "invalids":invalids,
-         "checkouts":checkouts,
-         "setlocals":setlocals,
-         "getlocals": getlocals,
-         "firstverb_name":firstverb_name,
-         "checkcues_switch":checkcues_switch,
-         "control_switch":control_switch,
-         "segue_previous":segue_previous,
-         "checkin":checkin}
-    
-        return b_code
+    %(requeue)s""" % \
+                {"ticks":ticks, "requeue":self.__GetRequeue(upper_name, "iTimeout-1", "iPollTicks")}
+
+            declarations_list = ["\n\nvoid evaluate_%s(int iBehaviour, int iEvents);" % (upper_name)]
+            evaluate_list = evaluate_template.RenderChunks(values)
+            for event, bit in verb_events:
+                values["event"] = event
+                values["bit"] = str(bit)
+                values["description"] = event_descriptions[event]
+                declarations_list.append(event_declaration_template.Render(values))
+                evaluate_list.append(event_hook_template.Render(values))
+
+            sections["checkcues_declarations"] = ''.join(declarations_list)
+            sections["checkcues_functions"] = evaluate_list
+            sections["control_evaluate"] = """
+    // The cues have changed, so see if any of them can fire right away.
+    // This is delayed until the current script returns, since a verb that
+    // completes straight away would run control_%s again from in here.
+    DelayCommand(0.0, evaluate_%s(iBehaviour, %d));
+""" % (upper_name, upper_name, all_events)
+
+        if self.backoff_idle_ticks > 0:
+            # Back off from the usual number of ticks between checks.
+            values = {"upper_name":upper_name,
+                      "cues_fired":sections["cues_fired"],
+                      "ticks":str(ticks),
+                      "idle_ticks":str(self.backoff_idle_ticks),
+                      "cap":str(max(self.backoff_cap, ticks))}
+            sections["checkcues_evaluate"] = [sections["cue_snapshot"] + "\n"] + \
+                                             list(sections["checkcues_evaluate"])
+            if self.scheduled == True:
+                # The scheduler can cut a long wait short by itself.
+                values["backoff_remember"] = ""
+                values["backoff_requeue"] = "    " + self.__GetRequeue(upper_name, "iTimeout-1", "iBackoffDelay")
+                sections["control_evaluate"] += backoff_scheduled_control_template.Render(values)
+            else:
+                values["backoff_remember"] = backoff_remember_template.Render(values)
+                values["backoff_requeue"] = backoff_heartbeat_template.Render(values)
+                sections["checkcues_declarations"] += backoff_declaration_template.Render(values)
+                sections["checkcues_functions"] = list(sections["checkcues_functions"]) + \
+                                                  [backoff_wake_template.Render(values)]
+                sections["control_evaluate"] += backoff_control_template.Render(values)
+            sections["checkcues_reschedule"] = backoff_reschedule_template.Render(values)
+
+        if self.scheduled == True:
+            values = {"upper_name":upper_name, "lower_name":sections["lower_name"]}
+            sections["checkcues_declarations"] += scheduled_declaration_template.Render(values)
+            sections["checkcues_functions"] = list(sections["checkcues_functions"]) + \
+                                              [scheduled_template.Render(values)]
+            sections["start_register"] = """\
+            // Hand the behaviour's heartbeat over to the scheduler.
+            register_%s(iID);
+
+""" % (upper_name)
+            sections["checkin"] += "\n    deregister_%s(iBehaviour);" % (upper_name)
+        else:
+            sections["start_register"] = ""
 
 class NWVariable(object):
     """Contains information about an NWScript variable.
@@ -553,14 +1756,16 @@ class NWVariable(object):
     This class also takes care of actors; actors are just a special case of a
     normal variable, except that each behaviour requires at least one actor,
     and actors are always objects."""
+    __slots__ = ("type", "name", "description", "isActor")
+
     def __init__(self, type="", name="", description="", isActor = False):
         """Sets up all the instance variables."""
-        self.type = type
+        self.type = Intern(type)
         """The type of the NWVariable.
         Valid types are defined in L{valid_nwvar_types}.
         @type: string
         """
-        self.name = name
+        self.name = Intern(name)
         """The name of the NWVariable.
         NWVariable names should follow conventions; the first letter of the variable
         is the first letter of the variable type, and the second letter is capitalized.
@@ -595,6 +1800,291 @@ class NWVariable(object):
         else:
             return None
 
+class ObservableList(list):
+    """A list that tells its owner whenever it is changed in place.
+
+    Verbs cache the code they generate, so they need to know when one of
+    their lists has been appended to, had an item replaced, etc.  Every
+    method that modifies the list calls the owner's C{Invalidate} method
+    after doing so."""
+    __slots__ = ("owner",)
+
+    def __init__(self, owner, items=()):
+        """Sets up the list.
+        @param owner: The object to notify of changes.  It must have an
+            C{Invalidate} method.
+        @param items: The initial contents of the list.
+        @type items: iterable
+        """
+        list.__init__(self, items)
+        self.owner = owner
+        """The object that is notified when the list changes.
+        @type: L{Verb}
+        """
+
+def _ObservedMethod(name):
+    """Wrap one of list's modifying methods so that it notifies the owner.
+    @param name: The name of the list method.
+    @type name: string
+    @return: The wrapped method.
+    @rtype: function
+    """
+    method = getattr(list, name)
+    def observed(self, *args):
+        result = method(self, *args)
+        self.owner.Invalidate()
+        return result
+    observed.__name__ = name
+    observed.__doc__ = method.__doc__
+    return observed
+
+for _name in ("append", "extend", "insert", "pop", "remove", "reverse", "sort",
+              "__setitem__", "__delitem__", "__setslice__", "__delslice__",
+              "__iadd__", "__imul__"):
+    if hasattr(list, _name):
+        setattr(ObservableList, _name, _ObservedMethod(_name))
+del _name
+
+class VerbList(list):
+    """An ordered list of verbs that can be looked up by context name and by
+    position in constant time.
+
+    The indexes are built the first time they are needed.  Appending a verb
+    adds it to them, and every other method that modifies the list throws
+    them away so they are rebuilt on the next lookup.  Renaming a verb
+    doesn't modify the list, so L{Reindex} should be called afterwards."""
+    __slots__ = ("names", "positions")
+
+    def __init__(self, verbs=()):
+        """Sets up the list.
+        @param verbs: The initial contents of the list.
+        @type verbs: iterable of L{Verb}s
+        """
+        list.__init__(self, verbs)
+        self.names = None
+        """The first verb with each context name, or None if not yet built.
+        @type: dict of strings to L{Verb}s
+        """
+        self.positions = None
+        """The position of each verb, keyed on C{id(verb)}, or None if not yet built.
+        @type: dict of ints to ints
+        """
+
+    def __reduce__(self):
+        """Pickle the verbs without the indexes, which are keyed on object IDs.
+
+        Verbs don't pickle their followers, since following a long chain of
+        them would recurse once per verb.  They are stored here instead, by
+        position where possible.
+        @return: The arguments to rebuild the list, and the followers.
+        @rtype: tuple
+        """
+        followers = []
+        for verb in self:
+            follower_list = []
+            for follower in verb.followers:
+                if follower in self:
+                    follower_list.append(self.IndexOf(follower))
+                else:
+                    follower_list.append(follower)
+            followers.append(follower_list)
+        return (VerbList, (list(self),), followers)
+
+    def __setstate__(self, followers):
+        """Restore the verbs' followers after unpickling.
+        @param followers: The followers of each verb, as stored by C{__reduce__}.
+        @type followers: list of lists
+        """
+        for verb, follower_list in zip(self, followers):
+            for follower in follower_list:
+                if isinstance(follower, int):
+                    follower = self[follower]
+                verb.followers.append(follower)
+
+    def __contains__(self, verb):
+        """Is the verb in the list?
+        @param verb: The verb to look for.
+        @type verb: L{Verb}
+        @rtype: bool
+        """
+        try:
+            self.IndexOf(verb)
+        except ValueError:
+            return False
+        return True
+
+    def append(self, verb):
+        """Add a verb to the end of the list, and to the indexes if they have been built.
+        @param verb: The verb to add.
+        @type verb: L{Verb}
+        """
+        list.append(self, verb)
+        if self.names is not None:
+            self.names.setdefault(verb.context_name, verb)
+            self.positions.setdefault(id(verb), len(self) - 1)
+
+    def Reindex(self):
+        """Rebuild the indexes.  Call this after renaming a verb."""
+        self.names = {}
+        self.positions = {}
+        for ix, verb in enumerate(self):
+            self.names.setdefault(verb.context_name, verb)
+            self.positions.setdefault(id(verb), ix)
+
+    def GetVerb(self, name):
+        """Find a verb by its context name.
+        @param name: The context name of the verb.
+        @type name: string
+        @return: The first verb with that context name, or None if there isn't one.
+        @rtype: L{Verb}
+        """
+        if self.names is None:
+            self.Reindex()
+        verb = self.names.get(name)
+        if verb is not None and verb.context_name != name:
+            # The verb was renamed without a call to Reindex.
+            self.Reindex()
+            verb = self.names.get(name)
+        return verb
+
+    def IndexOf(self, verb):
+        """Find the position of a verb.  Unlike C{index}, verbs are compared by
+        identity.
+        @param verb: The verb to look for.
+        @type verb: L{Verb}
+        @return: The position of the first occurrence of the verb.
+        @rtype: int
+        @raise ValueError: If the verb isn't in the list.
+        """
+        if self.positions is None:
+            self.Reindex()
+        ix = self.positions.get(id(verb))
+        if ix is None:
+            raise ValueError, "Verb not in the behaviour."
+        return ix
+
+def _IndexedMethod(name):
+    """Wrap one of list's modifying methods so that it throws away the indexes.
+    @param name: The name of the list method.
+    @type name: string
+    @return: The wrapped method.
+    @rtype: function
+    """
+    method = getattr(list, name)
+    def indexed(self, *args):
+        result = method(self, *args)
+        self.names = None
+        self.positions = None
+        return result
+    indexed.__name__ = name
+    indexed.__doc__ = method.__doc__
+    return indexed
+
+for _name in ("extend", "insert", "pop", "remove", "reverse", "sort",
+              "__setitem__", "__delitem__", "__setslice__", "__delslice__",
+              "__iadd__", "__imul__"):
+    if hasattr(list, _name):
+        setattr(VerbList, _name, _IndexedMethod(_name))
+del _name
+
+class Template(object):
+    """A code generation shell that has been compiled into segments.
+
+    Shells are written with C{%(section)s} placeholders, as they would be for
+    the C{%} operator.  Instead of re-interpolating the whole shell every time
+    code is generated, the shell is split into its literal chunks once, up
+    front.  Rendering then only has to drop the section values in between the
+    chunks and join the result."""
+    def __init__(self, shell):
+        """Compile the shell into segments.
+        @param shell: The shell, containing C{%(section)s} placeholders.
+        @type shell: string
+        """
+        chunks = placeholder_re.split(shell)
+
+        self.segments = []
+        """The compiled shell, as a list of C{(literal, section)} tuples.
+
+        The literal is the text preceding the placeholder for the section.  The
+        last segment holds the trailing text of the shell, and its section is None.
+        @type: list of tuples
+        """
+        for ix in range(0, len(chunks)-1, 2):
+            self.segments.append((chunks[ix].replace("%%", "%"), chunks[ix+1]))
+        self.segments.append((chunks[-1].replace("%%", "%"), None))
+
+        self.sections = [section for literal, section in self.segments[:-1]]
+        """The names of the sections used in the shell, in order of appearance.
+        A section may be listed more than once.
+        @type: list of strings
+        """
+
+        # The parts list is what actually gets joined; the literals sit in the
+        # even positions, and the odd positions are filled in on each render.
+        self.__parts = []
+        for literal, section in self.segments:
+            self.__parts.append(literal)
+            self.__parts.append(None)
+        self.__parts.pop()
+
+    def Render(self, values):
+        """Generate code by filling in the shell's sections.
+        @param values: The code for each section, keyed by section name.
+            Each value is either a string or a list of chunks (see L{Chunks}).
+        @type values: dict
+        @return: The generated code.
+        @rtype: string
+        @raise KeyError: Raised if a section used in the shell is missing from values.
+        """
+        parts = self.__parts[:]
+        for ix, section in enumerate(self.sections):
+            value = values[section]
+            if not isinstance(value, basestring):
+                value = ''.join(value)
+            parts[2*ix+1] = value
+        return ''.join(parts)
+
+    def RenderChunks(self, values):
+        """Generate code by filling in the shell's sections, leaving the code as
+        a list of chunks.  The result can be used as a section value for
+        another template, without being joined first.
+        @param values: The code for each section, keyed by section name.
+            Each value is either a string or a list of chunks (see L{Chunks}).
+        @type values: dict
+        @return: The generated code.
+        @rtype: list of strings
+        @raise KeyError: Raised if a section used in the shell is missing from values.
+        """
+        chunks = []
+        for literal, section in self.segments:
+            chunks.append(literal)
+            if section is not None:
+                value = values[section]
+                if isinstance(value, basestring):
+                    chunks.append(value)
+                else:
+                    chunks.extend(value)
+        return chunks
+
+    def Write(self, stream, values):
+        """Generate code by filling in the shell's sections, writing it out as we go.
+        @param stream: Where the code is written; only its C{write} method is used.
+        @type stream: file
+        @param values: The code for each section, keyed by section name.
+            Each value is either a string or a list of chunks (see L{Chunks}).
+        @type values: dict
+        @raise KeyError: Raised if a section used in the shell is missing from values.
+        """
+        for literal, section in self.segments:
+            stream.write(literal)
+            if section is not None:
+                value = values[section]
+                if isinstance(value, basestring):
+                    stream.write(value)
+                else:
+                    for chunk in value:
+                        stream.write(chunk)
+
 class Verb(object):
     """Verb generates code for each verb object.
 
@@ -602,8 +2092,17 @@ class Verb(object):
     to see the generated code for the control_<Behaviour> section.  Access
     the checkcues attribute to see the generated code for the
     checkcues_<Behaviour> section."""
+    __slots__ = ("__context_name", "__b_name", "__constant_name", "__actual_name",
+                 "__follower", "__terminal", "__followers", "__preconditions",
+                 "__vdarguments", "__varguments", "__events", "__verb_id", "__fragments")
+
     def __init__(self, behaviour):
         """Sets up all the instance variables."""
+        # The caches have to exist before anything else is set,
+        # since every assignment clears them.
+        self.__fragments = {}
+        self.__constant_name = None
+
         self.context_name = ""
         """A name that can identify the verb in the context of the behaviour.
         @type: string
@@ -613,16 +2112,6 @@ class Verb(object):
         This is required when generating the constant_name.
         @type: string
         """
-        self.constant_name = ""
-        """The constant that will be used to identify the verb in switch statements.
-        
-        It will be appended with the first two letters of the behaviour name to deal
-        with conflicts (if one includes two behaviours with the same constant name,
-        the script won't compile).
-        
-        e.g.: C{F_FI_INSTIGATE}
-        @type: string
-        """
         self.actual_name = ""
         """The name of the actual verb.
         
@@ -654,34 +2143,323 @@ class Verb(object):
         Not all verbs require arguments to be passed, so this can be empty.
         @type: list strings
         """
+        self.events = []
+        """The events that can change whether this verb's preconditions are met,
+        by name (see L{verb_events}).  Only used by event-driven behaviours.
+        @type: list of strings
+        """
+        self.verb_id = None
+        """The value of the verb's constant in the generated script.
+
+        IDs are handed out by L{Behaviour.AllocateVerbIds} and saved in the
+        opening comment block, so a verb keeps its ID from one save to the
+        next.  Followers have even IDs and supporters have odd IDs.  None
+        if the verb has not been given an ID yet.
+        @type: int
+        """
     
-    def __setattr__(self, name, value):
-        """Intercept assignments to the context_name or follower attributes,
-        so we can generate the constant_name automatically.
-        @param name: Name of the attribute being set.
-        @type name: string
-        @param value: The value to set the attribute to.
+    def __GetConstantName(self):
+        """Generate the constant name the first time it is asked for after a change.
+        @return: The constant name.
+        @rtype: string
         """
-        if name == "b_name":
-            if len(value) < 2:
-                value = "BH"
-            value = value.upper()
+        if self.__constant_name is None:
+            if self.__follower == False:
+                startchar = 'S'
+            else:
+                startchar = 'F'
+            
+            const_name = "%c_%c%c_%s" % (startchar, self.__b_name[0], self.__b_name[1], self.__context_name.upper())
+            self.__constant_name = Intern(const_name)
+        return self.__constant_name
+    
+    constant_name = property(__GetConstantName, doc=
+        """The constant that will be used to identify the verb in switch statements.
         
-        object.__setattr__(self, name, value)
+        It will be appended with the first two letters of the behaviour name to deal
+        with conflicts (if one includes two behaviours with the same constant name,
+        the script won't compile).  It is generated from the context_name,
+        follower and b_name attributes when it is needed.
         
-        if name == "context_name" or name == "follower" or name == "b_name":
-            # Only try to set the const_name if we have all the required attributes.
-            if hasattr(self, "follower") and hasattr(self, "context_name") and hasattr(self, "b_name"):
-                if object.__getattribute__(self, "follower") == False:
-                    startchar = 'S'
-                else:
-                    startchar = 'F'
-                
-                const_name = "%c_%c%c_%s" % (startchar, self.b_name[0], self.b_name[1], self.context_name.upper())
-                object.__setattr__(self, "constant_name", const_name)           
+        e.g.: C{F_FI_INSTIGATE}
+        @type: string
+        """)
     
-    def GenerateCheckcuesCode(self):
+    def __getstate__(self):
+        """Get the verb's attributes for pickling, leaving out the caches.
+
+        The followers are left out too; the L{VerbList} holding the verb
+        pickles them.
+        @return: The value of each attribute in L{verb_attributes}.
+        @rtype: dict
+        """
+        state = {}
+        for name in verb_attributes:
+            if name == "followers":
+                continue
+            value = getattr(self, name)
+            if isinstance(value, ObservableList):
+                value = list(value)
+            state[name] = value
+        return state
+
+    def __setstate__(self, state):
+        """Restore the verb's attributes after unpickling.
+        @param state: The state returned by C{__getstate__}.
+        @type state: dict
+        """
+        # The slots are filled in directly, since there are no caches to clear yet.
+        self.__fragments = {}
+        self.__constant_name = None
+        self.__context_name = Intern(state["context_name"])
+        self.__b_name = Intern(state["b_name"])
+        self.__actual_name = Intern(state["actual_name"])
+        self.__follower = state["follower"]
+        self.__terminal = state["terminal"]
+        self.__verb_id = state["verb_id"]
+        self.__followers = ObservableList(self)
+        self.__preconditions = ObservableList(self, state["preconditions"])
+        self.__vdarguments = ObservableList(self, state["vdarguments"])
+        self.__varguments = ObservableList(self, state["varguments"])
+        self.__events = ObservableList(self, state["events"])
+
+    def Invalidate(self):
+        """Discard the cached constant name and code fragments, so they are
+        generated again the next time they are asked for.
+
+        This is called automatically whenever the verb is changed."""
+        self.__constant_name = None
+        self.__fragments.clear()
+
+    def __GetFragment(self, name, key, generate):
+        """Get a code fragment from the cache, generating it if necessary.
+        @param name: The name of the fragment.
+        @type name: string
+        @param key: Anything outside of this verb that the fragment depends on.
+            If it differs from the key the fragment was cached with, the
+            fragment is generated again.
+        @param generate: The function that generates the fragment.
+        @type generate: callable
+        @return: The code fragment.
+        @rtype: string
+        """
+        fragment = self.__fragments.get(name)
+        if fragment is None or fragment[0] != key:
+            fragment = (key, generate())
+            self.__fragments[name] = fragment
+        return fragment[1]
+
+    def __GetControlKey(self):
+        """The control code names each follower's constant, so it has to be
+        regenerated if any of those change.
+        @return: The constant names of the followers.
+        @rtype: tuple of strings
+        """
+        if self.terminal == True:
+            return None
+        return tuple([follow.constant_name for follow in self.followers])
+
+    def GenerateInfo(self, number):
+        """Generate the lines describing this verb in the b_ file's opening comment block.
+        @param number: The verb's position in the behaviour, starting at 1.
+        @type number: int
+        @return: The generated lines.
+        @rtype: string
+        """
+        if self.terminal == True:
+            key = number
+        else:
+            key = (number, tuple([follow.context_name for follow in self.followers]))
+        return self.__GetFragment("info", key, lambda: self.__GenerateInfo(number))
+
+    def GenerateCheckcuesCase(self, hoisted=(), event_driven=False, cue_bits=None, ordered=None, counter=None):
+        """Generate this verb's case in the checkcues switch statement.
+        @param hoisted: The calls that have been hoisted out of the cue loop
+            (see L{Behaviour.FindHoistedCalls}).
+        @type hoisted: tuple of tuples
+        @param event_driven: Is the case part of an event-driven behaviour?
+        @type event_driven: bool
+        @param cue_bits: If the cues are kept as bits, the position of this
+            verb's bit, and the C{(word, mask)} pairs of the bits to clear
+            when it fires (see L{CueMasks}).
+        @type cue_bits: tuple
+        @param ordered: The preconditions in the order they should be tested,
+            if not the order they were written in (see L{OrderPreconditions}).
+        @type ordered: tuple of strings
+        @param counter: The function that counts the behaviour's running
+            verbs, if they are counted (see L{Behaviour.pool_size}).
+        @type counter: string
+        @return: The generated NWScript code.
+        @rtype: string
+        """
+        return self.__GetFragment("checkcues_case", (hoisted, event_driven, cue_bits, ordered, counter), lambda: \
+            self.__GenerateCheckcuesCase(hoisted, event_driven, cue_bits, ordered, counter))
+
+    def __GenerateCheckcuesCase(self, hoisted, event_driven, cue_bits, ordered, counter):
+        """Generate this verb's case in the checkcues switch statement, bypassing the cache.
+        @param hoisted: The calls that have been hoisted out of the cue loop.
+        @type hoisted: tuple of tuples
+        @param event_driven: Is the case part of an event-driven behaviour?
+        @type event_driven: bool
+        @param cue_bits: The position of this verb's bit, and the bits to clear.
+        @type cue_bits: tuple
+        @param ordered: The preconditions in the order they should be tested.
+        @type ordered: tuple of strings
+        @param counter: The function that counts the behaviour's running verbs.
+        @type counter: string
+        @return: The generated NWScript code.
+        @rtype: string
+        """
+        code = self.GenerateCheckcuesCode(hoisted, event_driven, cue_bits, ordered, counter)
+        if cue_bits is None:
+            return "        case %s:\n%s\n            break;" % (self.constant_name, code)
+
+        # The cue loop switches on the bit position, so it has to be told the verb.
+        return "        case %d:\n            iVerb = %s;\n%s\n            break;" % (cue_bits[0], self.constant_name, code)
+
+    def GenerateControlCase(self, cue_masks=None):
+        """Generate this verb's case in the control switch statement.
+        @param cue_masks: If the cues are kept as bits, the C{(word, mask)}
+            pairs of the followers' bits (see L{CueMasks}).
+        @type cue_masks: tuple of tuples
+        @return: The generated NWScript code.
+        @rtype: string
+        """
+        return self.__GetFragment("control_case", (self.__GetControlKey(), cue_masks), lambda: \
+            "    case %s:\n%s\n        break;" % (self.constant_name, self.GenerateControlCode(cue_masks)))
+
+    def GenerateCheckcuesCode(self, hoisted=(), event_driven=False, cue_bits=None, ordered=None, counter=None):
         """Generate the cueckcues code.
+        @param hoisted: The calls that have been hoisted out of the cue loop
+            (see L{Behaviour.FindHoistedCalls}).
+        @type hoisted: tuple of tuples
+        @param event_driven: Should the verb only be checked on its own events?
+        @type event_driven: bool
+        @param cue_bits: If the cues are kept as bits, the position of this
+            verb's bit, and the C{(word, mask)} pairs of the bits to clear
+            when it fires.
+        @type cue_bits: tuple
+        @param ordered: The preconditions in the order they should be tested,
+            if not the order they were written in (see L{OrderPreconditions}).
+        @type ordered: tuple of strings
+        @param counter: The function that counts the behaviour's running
+            verbs, if they are counted (see L{Behaviour.pool_size}).
+        @type counter: string
+        @return: The generated NWScript code.
+        @rtype: string
+        """
+        return self.__GetFragment("checkcues", (hoisted, event_driven, cue_bits, ordered, counter), lambda: \
+            self.__GenerateCheckcuesCode(hoisted, event_driven, cue_bits, ordered, counter))
+
+    def GetEventMask(self):
+        """Get the bits of the events this verb is re-evaluated on.
+        @return: The event mask; every event's bit is set if the verb doesn't list any.
+        @rtype: int
+        @raise ValueError: Raised if one of the verb's events is unknown.
+        """
+        if len(self.events) == 0:
+            return all_events
+
+        bits = dict(verb_events)
+        mask = 0
+        for event in self.events:
+            if event not in bits:
+                raise ValueError, "Unknown event: %s" % event
+            mask |= bits[event]
+        return mask
+
+    def GetPreconditionCalls(self):
+        """Find the function calls in this verb's preconditions.
+        @return: The text of each call, once for every time it appears.
+        @rtype: tuple of strings
+        """
+        return self.__GetFragment("calls", None, lambda: \
+            tuple([call for precond in self.preconditions for call in FindCalls(precond)]))
+
+    def GenerateControlCode(self, cue_masks=None):
+        """Generate the control code.
+        @param cue_masks: If the cues are kept as bits, the C{(word, mask)}
+            pairs of the followers' bits.
+        @type cue_masks: tuple of tuples
+        @return: The generated NWScript code.
+        @rtype: string
+        """
+        return self.__GetFragment("control", (self.__GetControlKey(), cue_masks), lambda: \
+            self.__GenerateControlCode(cue_masks))
+
+    def GetIdentifiers(self):
+        """Find the identifiers used in this verb's preconditions, VerbData
+        arguments and verb arguments.  Anything inside a string literal is ignored.
+        @return: The identifiers.
+        @rtype: frozenset of strings
+        """
+        return self.__GetFragment("identifiers", None, self.__FindIdentifiers)
+
+    def __FindIdentifiers(self):
+        """Find the identifiers used by this verb, bypassing the cache.
+        @return: The identifiers.
+        @rtype: frozenset of strings
+        """
+        code = " ".join(list(self.preconditions) + list(self.vdarguments) + list(self.varguments))
+        return frozenset(identifier_re.findall(string_literal_re.sub("", code)))
+
+    def __GenerateInfo(self, number):
+        """Generate the lines describing this verb in the opening comment block,
+        bypassing the cache.
+        @param number: The verb's position in the behaviour, starting at 1.
+        @type number: int
+        @return: The generated lines.
+        @rtype: string
+        """
+        if self.follower == True:
+            follow_text = "Follower"
+        else:
+            follow_text = "Supporter"
+
+        if self.terminal == True:
+            terminal_text = "Terminal"
+        else:
+            terminal_text = ""
+
+        info_list = ["VERB%d: %s %s %s %s" % (number, self.context_name, self.actual_name, follow_text, terminal_text)]
+
+        if self.verb_id is not None:
+            info_list.append("    VERB%d_ID: %d" % (number, self.verb_id))
+
+        if len(self.preconditions) > 0:
+            info_list.append("    VERB%d_PRECONDITIONS: %s" % (number, ";; ".join(self.preconditions)))
+
+        if self.terminal == False:
+            followers_text = "    VERB%d_FOLLOWERS: " % (number)
+            for follow in self.followers:
+                followers_text += (follow.context_name + ' ')
+            info_list.append(followers_text)
+
+        vdargs_text = "    VERB%d_VERBDATA: " % (number)
+        for vdarg in self.vdarguments:
+            vdargs_text += (vdarg + ' ')
+        info_list.append(vdargs_text)
+
+        if len(self.varguments) > 0:
+            info_list.append("    VERB%d_ARGUMENTS: %s" % (number, ";; ".join(self.varguments)))
+
+        if len(self.events) > 0:
+            info_list.append("    VERB%d_EVENTS: %s" % (number, " ".join(self.events)))
+
+        return '\n'.join(info_list)
+
+    def __GenerateCheckcuesCode(self, hoisted, event_driven, cue_bits, ordered, counter):
+        """Generate the cueckcues code, bypassing the cache.
+        @param hoisted: The calls that have been hoisted out of the cue loop.
+        @type hoisted: tuple of tuples
+        @param event_driven: Should the verb only be checked on its own events?
+        @type event_driven: bool
+        @param cue_bits: The position of this verb's bit, and the bits to clear.
+        @type cue_bits: tuple
+        @param ordered: The preconditions in the order they should be tested.
+        @type ordered: tuple of strings
+        @param counter: The function that counts the behaviour's running verbs.
+        @type counter: string
         @return: The generated NWScript code.
         @rtype: string
         """
@@ -691,7 +2469,20 @@ class Verb(object):
         if len(self.preconditions) == 0:
             preconditions = ""
         else:
-            preconditions = "if (%s)\n            " % (" && ".join(self.preconditions))
+            if ordered is None:
+                ordered = self.preconditions
+            preconditions = " && ".join(ordered)
+
+            # Use the locals holding the hoisted calls.
+            preconditions = SubstituteHoisted(preconditions, hoisted)
+
+            # (iEvents & <event mask>) && <preconditions>
+            # e.g.:
+            # (iEvents & 3) && GetIsDead(oVictim)
+            if event_driven == True and len(self.events) > 0:
+                preconditions = "(iEvents & %d) && %s" % (self.GetEventMask(), preconditions)
+
+            preconditions = "if (%s)\n            " % (preconditions)
 
         # <actual verb name>
         # e.g.:
@@ -719,10 +2510,34 @@ class Verb(object):
         # clearFollowerCues(iBehaviour); OR removeCue(iBehaviour, <constant_name>);
         # e.g.:
         # removeCue(iBehaviour, S_CALLFORHELP_29);
-        if self.follower == True:
-            clear = "clearFollowerCues(iBehaviour);"
+        # c_max = getNumCues(iBehaviour);
+        if cue_bits is None:
+            if self.follower == True:
+                clear = "clearFollowerCues(iBehaviour);"
+            else:
+                clear = "removeCue(iBehaviour, %s);" % (self.constant_name)
+            clear += "\n                c_max = getNumCues(iBehaviour);"
+
+        # SetLocalInt(oCues, "iCues<word>", GetLocalInt(oCues, "iCues<word>") & ~<mask>);
+        # iCues &= ~<mask in this verb's word>;
+        # e.g.:
+        # SetLocalInt(oCues, "iCues0", GetLocalInt(oCues, "iCues0") & ~5);
+        # iCues &= ~5;
         else:
-            clear = "removeCue(iBehaviour, %s);" % (self.constant_name)
+            position, masks = cue_bits
+            clear_list = []
+            for word, mask in masks:
+                clear_list.append("SetLocalInt(oCues, \"iCues%d\", GetLocalInt(oCues, \"iCues%d\") & ~%d);" % (word, word, mask))
+            own_mask = dict(masks).get(position / cue_word_bits)
+            if own_mask is not None and self.follower == True:
+                clear_list.append("iCues &= ~%d;" % (own_mask))
+            clear = "\n                ".join(clear_list)
+
+        # count_<behaviour name capitalized>(iBehaviour, 1);
+        # e.g.:
+        # count_Fight(iBehaviour, 1);
+        if counter is not None:
+            clear = "%s(iBehaviour, 1);\n                %s" % (counter, clear)
 
         # Generate the code
 
@@ -730,7 +2545,6 @@ class Verb(object):
             %(preconditions)s{
                 %(actual)s (VerbData(iVerb, iBehaviour%(vdargs)s)%(vargs)s);
                 %(clear)s
-                c_max = getNumCues(iBehaviour);
             }""" % {"preconditions":preconditions,
                   "actual":actual,
                   "vdargs":vdargs,
@@ -739,8 +2553,10 @@ class Verb(object):
         
         return checkcues
 
-    def GenerateControlCode(self):
-        """Generate the control code.
+    def __GenerateControlCode(self, cue_masks):
+        """Generate the control code, bypassing the cache.
+        @param cue_masks: If the cues are kept as bits, the followers' bits.
+        @type cue_masks: tuple of tuples
         @return: The generated NWScript code.
         @rtype: string
         """
@@ -757,11 +2573,766 @@ class Verb(object):
             # addCue(iBehaviour, F_RETALIATE_G8);
             # addCue(iBehaviour, S_CALLFORHELP_29);
             addcues_list = []
-            for follow in self.followers:
-                addcues_list.append("        addCue(iBehaviour, %s);" % (follow.constant_name))
+            if cue_masks is None:
+                for follow in self.followers:
+                    addcues_list.append("        addCue(iBehaviour, %s);" % (follow.constant_name))
+
+            # SetLocalInt(oCues, "iCues<word>", GetLocalInt(oCues, "iCues<word>") | <mask>);
+            # e.g.:
+            # SetLocalInt(oCues, "iCues0", GetLocalInt(oCues, "iCues0") | 6);
+            else:
+                for word, mask in cue_masks:
+                    addcues_list.append("        SetLocalInt(oCues, \"iCues%d\", GetLocalInt(oCues, \"iCues%d\") | %d);" % (word, word, mask))
 
             # Generate the code
 
             control = '\n'.join(addcues_list)
         
         return control
+
+def _VerbAttribute(name):
+    """Make a property for one of L{Verb}'s attributes.
+
+    Setting the attribute stores the value in the matching slot, then calls
+    L{Verb.Invalidate}.  Names are interned, the behaviour name is cleaned up,
+    and lists are wrapped in L{ObservableList}s.
+    @param name: The name of the attribute.
+    @type name: string
+    @return: The property.
+    @rtype: property
+    """
+    slot = getattr(Verb, "_Verb__" + name)
+    if name == "b_name":
+        def set(verb, value):
+            if len(value) < 2:
+                value = "BH"
+            slot.__set__(verb, Intern(value.upper()))
+            verb.Invalidate()
+    elif name in observed_verb_lists:
+        def set(verb, value):
+            if not (isinstance(value, ObservableList) and value.owner is verb):
+                value = ObservableList(verb, value)
+            slot.__set__(verb, value)
+            verb.Invalidate()
+    elif name in ("context_name", "actual_name"):
+        def set(verb, value):
+            slot.__set__(verb, Intern(value))
+            verb.Invalidate()
+    else:
+        def set(verb, value):
+            slot.__set__(verb, value)
+            verb.Invalidate()
+    return property(slot.__get__, set)
+
+for _name in verb_attributes:
+    setattr(Verb, _name, _VerbAttribute(_name))
+del _name
+
+b_template = Template("""\
+/* CODE GENERATED BY BEHAVIOUR TOOL
+Don't delete this comment block! You can, however, modify the elements.  Changes will show up when you reload the file.
+BEHAVIOUR: %(upper_name)s%(options_info)s
+%(verb_info)s
+%(actor_info)s
+%(nwvar_info)s
+ */
+        
+#include \"util_bintarray\"
+#include \"util_behaviour\"
+#include \"util_verbs\"
+
+/////////// Constants ///////////
+%(constants)s
+
+/////////// Declarations ///////////
+
+// Initializes the %(upper_name)s behaviour.
+%(nwvar_comments)s
+int start_%(upper_name)s(int iTimeout, int iInterrupt%(nwvars)s);
+void checkcues_%(upper_name)s(int iTimeout, int iBehaviour);
+void control_%(upper_name)s(int iBehaviour, int iVerb);
+void cleanup_%(upper_name)s(int iBehaviour);
+void timeout_%(upper_name)s(int iBehaviour);
+void segue_%(upper_name)s(int iBehaviour);%(resume_declaration)s%(checkcues_declarations)s%(pool_declarations)s%(completion_declarations)s%(loader_declaration)s
+
+/////////// Implementations ///////////
+
+int start_%(upper_name)s(int iTimeout, int iInterrupt%(nwvars)s)
+{
+    // Make sure we have have what we need to start the behaviour.
+    if (%(invalids)s)
+    {
+        object o%(upper_name)s = %(create_object)s;
+        int iID = GetLocalInt(o%(upper_name)s, \"ID\");
+
+        // Check out our actors.
+        if (%(checkouts)s)
+        {
+            // Set necessary parameters on the behaviour object.
+%(setlocals)s
+            SetLocalInt   (o%(upper_name)s, \"iInterrupt\", iInterrupt);
+            SetLocalString(o%(upper_name)s, \"sScript\", \"z_b_%(lower_name)s\");
+
+%(start_cues)s
+
+%(start_register)s            checkcues_%(upper_name)s(iTimeout, iID);
+
+            return iID;
+        }
+    }
+
+    return FALSE;
+}
+
+void checkcues_%(upper_name)s(int iTimeout, int iBehaviour)
+{
+%(checkcues_locals)s
+
+    // Are we finished?
+    if (getBehaviourFinished(iBehaviour))
+    {
+        cleanup_%(upper_name)s(iBehaviour);
+        return;
+    }
+
+    // Check to see if we want to segue before we check if we're paused.
+    if (getSegueToBehaviour(iBehaviour))
+    {
+        segue_%(upper_name)s(iBehaviour);
+        setSegueToBehaviour(iBehaviour, FALSE);
+        setBehaviourPaused(iBehaviour, FALSE);
+        %(segue_requeue)s
+        return;
+    }
+
+    // If we're paused, we'll just idle (no need to check as often as usual).
+    if (getBehaviourPaused(iBehaviour))
+    {
+%(debug_paused)s        %(paused_requeue)s
+        return;
+    }
+
+    // Have we timed out?
+    if (!iTimeout)
+    {
+        timeout_%(upper_name)s(iBehaviour);
+        %(timeout_requeue)s
+        return;
+    }
+
+%(checkcues_evaluate)s
+
+%(checkcues_reschedule)s
+%(debug_tick)s}
+%(checkcues_functions)s
+void control_%(upper_name)s(int iBehaviour, int iVerb)
+{
+%(control_locals)s
+
+%(control_dispatch)s
+%(control_evaluate)s}
+
+void cleanup_%(upper_name)s(int iBehaviour)
+{
+%(cleanup_locals)s
+    int iInterrupt = GetLocalInt(o%(upper_name)s, \"iInterrupt\");
+
+    // If we paused behaviours, we'll segue back into them.
+    if (iInterrupt == INTERRUPT_PAUSE)
+    {
+        int iPrevious;%(previous_object)s
+        
+%(segue_previous)s
+    }
+
+%(checkin)s
+    %(destroy_object)s
+}
+
+void timeout_%(upper_name)s(int iBehaviour)
+{
+%(timeout_locals)s
+
+    // Insert timeout handling code here
+
+    setBehaviourFinished(iBehaviour);
+}
+
+void segue_%(upper_name)s(int iBehaviour)
+{
+%(segue_locals)s
+
+    // Insert segue handling code here
+}
+%(resume_function)s%(pool_functions)s%(completion_functions)s%(loader)s""")
+"""The compiled shell for C{b_<behaviour>} files.
+@type: L{Template}
+"""
+
+cue_loop_template = Template("""\
+%(hoisted_locals)s    // Run through each cue and see if any of them fire
+    int c_ix, c_max, iVerb;
+
+    c_max = getNumCues(iBehaviour);
+
+    for (c_ix = 0; c_ix < c_max; c_ix++)
+    {
+        iVerb = getNextCue(iBehaviour);
+%(debug_cue)s
+%(checkcues_dispatch)s
+    }""")
+"""The compiled shell for the loop that checks each cue in a C{b_<behaviour>} file.
+@type: L{Template}
+"""
+
+bitset_cue_loop_template = Template("""\
+%(hoisted_locals)s    // Run through each cue and see if any of them fire.  The cues are
+    // kept as bits, %(word_bits)s to a word, and the switch is on the bit's position.
+    object oCues = getBehaviourObject(iBehaviour);
+    int iCue, iCues, iVerb;
+
+    for (iCue = 0; iCue < %(cue_count)s; iCue++)
+    {
+        // Load each word as we come to it, skipping the word if it's empty.
+        if (iCue %% %(word_bits)s == 0)
+        {
+            iCues = GetLocalInt(oCues, \"iCues\" + IntToString(iCue / %(word_bits)s));
+            if (!iCues)
+            {
+                iCue += %(word_skip)s;
+                continue;
+            }
+        }
+        if (!(iCues & (1 << (iCue %% %(word_bits)s))))
+        {
+            continue;
+        }
+%(debug_cue)s
+%(checkcues_dispatch)s
+    }""")
+"""The compiled shell for the cue loop of behaviours that keep their cues as bits.
+@type: L{Template}
+"""
+
+limited_cue_loop_template = Template("""\
+%(hoisted_locals)s%(cue_limit_info)s    // getNextCue carries on from where we stopped on the next call.
+    int c_ix, c_max, iVerb;
+
+    c_max = getNumCues(iBehaviour);
+
+    for (c_ix = 0; c_ix < c_max && c_ix < %(cue_limit)s; c_ix++)
+    {
+        iVerb = getNextCue(iBehaviour);
+%(debug_cue)s
+%(checkcues_dispatch)s
+    }""")
+"""The compiled shell for the cue loop of behaviours with an instruction budget.
+@type: L{Template}
+"""
+
+limited_bitset_cue_loop_template = Template("""\
+%(hoisted_locals)s%(cue_limit_info)s    // The last cue we looked at is kept in iCueCursor, so we can carry on
+    // from the one after it.
+    object oCues = getBehaviourObject(iBehaviour);
+    int iCue = GetLocalInt(oCues, \"iCueCursor\");
+    int iChecked, iSeen, iCues, iVerb;
+
+    for (iSeen = 0; iSeen < %(cue_count)s && iChecked < %(cue_limit)s; iSeen++)
+    {
+        // Move on to the next cue, loading its word if we've just come to it.
+        iCue++;
+        if (iCue >= %(cue_count)s)
+        {
+            iCue = 0;
+        }
+        if (iSeen == 0 || iCue %% %(word_bits)s == 0)
+        {
+            iCues = GetLocalInt(oCues, \"iCues\" + IntToString(iCue / %(word_bits)s));
+        }
+        if (!(iCues & (1 << (iCue %% %(word_bits)s))))
+        {
+            continue;
+        }
+        iChecked++;
+%(debug_cue)s
+%(checkcues_dispatch)s
+    }
+    SetLocalInt(oCues, \"iCueCursor\", iCue);""")
+"""The compiled shell for the cue loop of behaviours that keep their cues as
+bits, and have an instruction budget.
+@type: L{Template}
+"""
+
+evaluate_template = Template("""
+// Checks the %(upper_name)s behaviour's cues.  Verbs that are waiting on
+// events are only checked if one of their events is set in iEvents.
+void evaluate_%(upper_name)s(int iBehaviour, int iEvents)
+{
+%(evaluate_locals)s
+
+    // Paused and finished behaviours are left to checkcues_%(upper_name)s.
+    if (getBehaviourFinished(iBehaviour) || getBehaviourPaused(iBehaviour))
+    {
+        return;
+    }
+
+%(cue_loop)s
+}
+""")
+"""The compiled shell for the C{evaluate_<behaviour>} function of event-driven behaviours.
+@type: L{Template}
+"""
+
+event_declaration_template = Template("""
+
+// Checks the cues of oActor's %(upper_name)s behaviour %(description)s.
+void %(event)s_%(upper_name)s(object oActor);""")
+"""The compiled shell for the declaration of an event hook.
+@type: L{Template}
+"""
+
+event_hook_template = Template("""
+void %(event)s_%(upper_name)s(object oActor)
+{
+    int iBehaviour = GetLocalInt(oActor, \"b_%(lower_name)s\");
+    if (iBehaviour)
+    {
+        evaluate_%(upper_name)s(iBehaviour, %(bit)s);
+    }
+}
+""")
+"""The compiled shell for an event hook's implementation.
+@type: L{Template}
+"""
+
+backoff_declaration_template = Template("""
+
+// Calls checkcues_%(upper_name)s, unless the heartbeat has been restarted
+// since the call was scheduled.
+void wake_%(upper_name)s(int iTimeout, int iBehaviour, int iHeartbeat);""")
+"""The compiled shell for the declaration of C{wake_<behaviour>}, used when backing off.
+@type: L{Template}
+"""
+
+backoff_wake_template = Template("""
+void wake_%(upper_name)s(int iTimeout, int iBehaviour, int iHeartbeat)
+{
+    object oBackoff = getBehaviourObject(iBehaviour);
+    if (GetLocalInt(oBackoff, \"iBackoffHeartbeat\") == iHeartbeat)
+    {
+        SetLocalInt(oBackoff, \"iBackoffWaiting\", FALSE);
+        checkcues_%(upper_name)s(iTimeout, iBehaviour);
+    }
+}
+""")
+"""The compiled shell for the implementation of C{wake_<behaviour>}.
+@type: L{Template}
+"""
+
+backoff_reschedule_template = Template("""\
+    // Slow down while no cues are firing, and speed up again as soon as one does.
+    object oBackoff = getBehaviourObject(iBehaviour);
+    int iBackoffDelay = GetLocalInt(oBackoff, \"iBackoffDelay\");
+    int iBackoffIdle = GetLocalInt(oBackoff, \"iBackoffIdle\") + 1;
+    if (%(cues_fired)s)
+    {
+        iBackoffIdle = 0;
+    }
+    if (iBackoffIdle < %(idle_ticks)s || iBackoffDelay < %(ticks)s)
+    {
+        iBackoffDelay = %(ticks)s;
+    }
+    else if (iBackoffDelay < %(cap)s)
+    {
+        iBackoffDelay *= 2;
+        if (iBackoffDelay > %(cap)s)
+        {
+            iBackoffDelay = %(cap)s;
+        }
+    }
+    SetLocalInt(oBackoff, \"iBackoffIdle\", iBackoffIdle);
+    SetLocalInt(oBackoff, \"iBackoffDelay\", iBackoffDelay);
+
+    // A timeout that runs out sooner cuts the wait short.
+    if (iTimeout > 0 && iTimeout < iBackoffDelay)
+    {
+        iBackoffDelay = iTimeout;
+    }
+%(backoff_remember)s
+    // Count the heartbeats we skip against the timeout, without skipping
+    // past zero (negative timeouts never run out).
+    if (iTimeout > iBackoffDelay)
+    {
+        iTimeout -= iBackoffDelay - 1;
+    }
+    else if (iTimeout > 0)
+    {
+        iTimeout = 1;
+    }
+
+%(backoff_requeue)s""")
+"""The compiled shell for rescheduling C{checkcues_<behaviour>} when backing off.
+@type: L{Template}
+"""
+
+backoff_remember_template = Template("""
+    // Remember enough for control_%(upper_name)s to cut a long wait short:
+    // the timeout before the wait, and when the wait started.  The game's
+    // clock is kept as whole hours and the seconds into the hour, since a
+    // float can't hold the whole time precisely.
+    SetLocalInt(oBackoff, \"iBackoffWaiting\", iBackoffDelay > %(ticks)s);
+    if (iBackoffDelay > %(ticks)s)
+    {
+        SetLocalInt(oBackoff, \"iBackoffTimeout\", iTimeout);
+        SetLocalInt(oBackoff, \"iBackoffStartHour\", ((GetCalendarYear()*12 + GetCalendarMonth())*28 + GetCalendarDay())*24 + GetTimeHour());
+        SetLocalFloat(oBackoff, \"fBackoffStartSecond\", IntToFloat(GetTimeMinute()*60 + GetTimeSecond()) + IntToFloat(GetTimeMillisecond())/1000.0);
+    }
+""")
+"""The compiled shell for remembering the start of a long wait when backing off.
+@type: L{Template}
+"""
+
+backoff_heartbeat_template = Template("""\
+    int iHeartbeat = GetLocalInt(oBackoff, \"iBackoffHeartbeat\") + 1;
+    SetLocalInt(oBackoff, \"iBackoffHeartbeat\", iHeartbeat);
+    DelayCommand(iBackoffDelay*DEFAULT_HEARTBEAT_DELAY, wake_%(upper_name)s(iTimeout-1, iBehaviour, iHeartbeat));""")
+"""The compiled shell for scheduling C{wake_<behaviour>} when backing off.
+@type: L{Template}
+"""
+
+backoff_control_template = Template("""
+    // A verb has completed, so go back to the usual heartbeat straight away.
+    object oBackoff = getBehaviourObject(iBehaviour);
+    SetLocalInt(oBackoff, \"iBackoffIdle\", 0);
+    SetLocalInt(oBackoff, \"iBackoffDelay\", %(ticks)s);
+    if (GetLocalInt(oBackoff, \"iBackoffWaiting\"))
+    {
+        // Restarting the heartbeat stops the waiting call from going through.
+        int iHeartbeat = GetLocalInt(oBackoff, \"iBackoffHeartbeat\") + 1;
+        SetLocalInt(oBackoff, \"iBackoffHeartbeat\", iHeartbeat);
+        SetLocalInt(oBackoff, \"iBackoffWaiting\", FALSE);
+
+        // Only charge the timeout for the heartbeats that have passed since
+        // the wait started, and the one until the wake-up.
+        int iWaitedHours = ((GetCalendarYear()*12 + GetCalendarMonth())*28 + GetCalendarDay())*24 + GetTimeHour() - GetLocalInt(oBackoff, \"iBackoffStartHour\");
+        float fWaited = IntToFloat(iWaitedHours)*HoursToSeconds(1) + IntToFloat(GetTimeMinute()*60 + GetTimeSecond()) + IntToFloat(GetTimeMillisecond())/1000.0 - GetLocalFloat(oBackoff, \"fBackoffStartSecond\");
+        int iElapsed = FloatToInt(fWaited/DEFAULT_HEARTBEAT_DELAY) + 1;
+        int iTimeout = GetLocalInt(oBackoff, \"iBackoffTimeout\");
+        if (iTimeout > iElapsed)
+        {
+            iTimeout -= iElapsed;
+        }
+        else if (iTimeout > 0)
+        {
+            iTimeout = 0;
+        }
+        else
+        {
+            iTimeout -= 1;
+        }
+        DelayCommand(DEFAULT_HEARTBEAT_DELAY, wake_%(upper_name)s(iTimeout, iBehaviour, iHeartbeat));
+    }
+""")
+"""The compiled shell for snapping back to the usual heartbeat in C{control_<behaviour>}.
+@type: L{Template}
+"""
+
+backoff_scheduled_control_template = Template("""
+    // A verb has completed, so go back to the usual heartbeat straight away.
+    object oBackoff = getBehaviourObject(iBehaviour);
+    SetLocalInt(oBackoff, \"iBackoffIdle\", 0);
+    SetLocalInt(oBackoff, \"iBackoffDelay\", %(ticks)s);
+    if (GetLocalInt(oBackoff, \"iScheduledWait\") > 1)
+    {
+        SetLocalInt(oBackoff, \"iScheduledWait\", 1);
+    }
+""")
+"""The compiled shell for snapping back to the usual heartbeat in the
+C{control_<behaviour>} function of a scheduled behaviour.
+@type: L{Template}
+"""
+
+scheduled_declaration_template = Template("""
+
+// Adds the %(upper_name)s behaviour to the scheduler, which will call
+// tick_%(upper_name)s on every heartbeat until it is removed again.
+void register_%(upper_name)s(int iBehaviour);
+void deregister_%(upper_name)s(int iBehaviour);
+void tick_%(upper_name)s(int iBehaviour);
+void requeue_%(upper_name)s(int iBehaviour, int iTimeout, int iTicks);""")
+"""The compiled shell for the declarations of a scheduled behaviour's functions.
+@type: L{Template}
+"""
+
+scheduled_template = Template("""
+void register_%(upper_name)s(int iBehaviour)
+{
+    object oModule = GetModule();
+    int iCount = GetLocalInt(oModule, \"b_scheduled_%(lower_name)s\");
+    SetLocalInt(oModule, \"b_scheduled_%(lower_name)s_\" + IntToString(iCount), iBehaviour);
+    SetLocalInt(getBehaviourObject(iBehaviour), \"iScheduledIndex\", iCount);
+    SetLocalInt(oModule, \"b_scheduled_%(lower_name)s\", iCount + 1);
+}
+
+// Removes the behaviour from the scheduler, moving the last registered
+// %(upper_name)s behaviour into its place.
+void deregister_%(upper_name)s(int iBehaviour)
+{
+    object oModule = GetModule();
+    int iCount = GetLocalInt(oModule, \"b_scheduled_%(lower_name)s\") - 1;
+    int iIndex = GetLocalInt(getBehaviourObject(iBehaviour), \"iScheduledIndex\");
+    int iLast = GetLocalInt(oModule, \"b_scheduled_%(lower_name)s_\" + IntToString(iCount));
+    SetLocalInt(oModule, \"b_scheduled_%(lower_name)s_\" + IntToString(iIndex), iLast);
+    SetLocalInt(getBehaviourObject(iLast), \"iScheduledIndex\", iIndex);
+    DeleteLocalInt(oModule, \"b_scheduled_%(lower_name)s_\" + IntToString(iCount));
+    SetLocalInt(oModule, \"b_scheduled_%(lower_name)s\", iCount);
+}
+
+// Called by the scheduler on every heartbeat; checks the cues once the
+// behaviour has waited as long as it asked to.
+void tick_%(upper_name)s(int iBehaviour)
+{
+    object oScheduled = getBehaviourObject(iBehaviour);
+    int iWait = GetLocalInt(oScheduled, \"iScheduledWait\") - 1;
+    if (iWait > 0)
+    {
+        SetLocalInt(oScheduled, \"iScheduledWait\", iWait);
+        return;
+    }
+
+    SetLocalInt(oScheduled, \"iScheduledWait\", 0);
+    checkcues_%(upper_name)s(GetLocalInt(oScheduled, \"iScheduledTimeout\"), iBehaviour);
+}
+
+// Has the scheduler check the cues again in iTicks heartbeats.
+void requeue_%(upper_name)s(int iBehaviour, int iTimeout, int iTicks)
+{
+    object oScheduled = getBehaviourObject(iBehaviour);
+    SetLocalInt(oScheduled, \"iScheduledTimeout\", iTimeout);
+    SetLocalInt(oScheduled, \"iScheduledWait\", iTicks);
+}
+""")
+"""The compiled shell for the implementations of a scheduled behaviour's functions.
+@type: L{Template}
+"""
+
+scheduler_template = Template("""\
+/* CODE GENERATED BY BEHAVIOUR TOOL */
+
+%(includes)s
+
+// Runs one heartbeat of every scheduled behaviour, then schedules the next.
+void tick_scheduler()
+{
+    object oModule = GetModule();
+    int ix;
+%(ticks)s
+
+    DelayCommand(DEFAULT_HEARTBEAT_DELAY, tick_scheduler());
+}
+
+// main starts the scheduler; run this script once, e.g. from the module's
+// OnModuleLoad script.
+void main()
+{
+    object oModule = GetModule();
+    if (!GetLocalInt(oModule, \"b_scheduler_running\"))
+    {
+        SetLocalInt(oModule, \"b_scheduler_running\", TRUE);
+        tick_scheduler();
+    }
+}
+""")
+"""The compiled shell for the module's scheduler script.
+@type: L{Template}
+"""
+
+resume_template = Template("""
+// Carries on with a behaviour that was suspended while it was paused.  The
+// fallback check calls this with the suspension it was scheduled for, and
+// z_b_%(upper_name)s with 0 once a behaviour that paused it has finished.
+void resume_%(upper_name)s(int iBehaviour, int iSuspended)
+{
+    object oSuspended = getBehaviourObject(iBehaviour);
+    int iCurrent = GetLocalInt(oSuspended, \"iSuspended\");
+    if (!iCurrent || (iSuspended && iSuspended != iCurrent))
+    {
+        return;
+    }
+
+    DeleteLocalInt(oSuspended, \"iSuspended\");%(register)s
+    checkcues_%(upper_name)s(GetLocalInt(oSuspended, \"iSuspendedTimeout\"), iBehaviour);
+}
+""")
+"""The compiled shell for the function that wakes a suspended behaviour.
+@type: L{Template}
+"""
+
+pool_template = Template("""
+// Takes a behaviour object from the %(upper_name)s pool, or creates one if
+// the pool is empty.
+object acquire_%(upper_name)s()
+{
+    object oModule = GetModule();
+    int iPooled = GetLocalInt(oModule, \"b_pool_%(lower_name)s\");
+    while (iPooled > 0)
+    {
+        iPooled--;
+        SetLocalInt(oModule, \"b_pool_%(lower_name)s\", iPooled);
+        object oPooled = getBehaviourObject(GetLocalInt(oModule, \"b_pool_%(lower_name)s_\" + IntToString(iPooled)));
+        if (GetIsObjectValid(oPooled))
+        {
+            return oPooled;
+        }
+    }
+    return createBehaviourObject();
+}
+
+// Counts the verbs a %(upper_name)s run has started that haven't completed
+// yet, so that an object isn't pooled while a verb can still report to it.
+void count_%(upper_name)s(int iBehaviour, int iChange)
+{
+    object oCounted = getBehaviourObject(iBehaviour);
+    SetLocalInt(oCounted, \"iVerbsRunning\", GetLocalInt(oCounted, \"iVerbsRunning\") + iChange);
+}
+
+// Resets a finished behaviour object and puts it back in the %(upper_name)s
+// pool, or destroys it if the pool is full.  The object keeps its ID, so an
+// object that still has verbs running is destroyed too: their completions
+// would otherwise reach the next run that uses it.
+void release_%(upper_name)s(int iBehaviour)
+{
+    object oModule = GetModule();
+    object oPooled = getBehaviourObject(iBehaviour);
+    int iPooled = GetLocalInt(oModule, \"b_pool_%(lower_name)s\");
+    if (iPooled >= %(pool_size)s || GetLocalInt(oPooled, \"iVerbsRunning\"))
+    {
+        destroyBehaviourObject(iBehaviour);
+        return;
+    }
+
+    // Clear what the last run left on the object.
+%(pool_resets)s
+    setBehaviourPaused(iBehaviour, FALSE);
+    setSegueToBehaviour(iBehaviour, FALSE);
+
+    // setBehaviourFinished can't clear the finished flag, so its local is
+    // cleared directly.  The local's name is assumed, so if the object still
+    // reads as finished, it can't be reused.
+    DeleteLocalInt(oPooled, \"%(finished_local)s\");
+    if (getBehaviourFinished(iBehaviour))
+    {
+        destroyBehaviourObject(iBehaviour);
+        return;
+    }
+
+    SetLocalInt(oModule, \"b_pool_%(lower_name)s_\" + IntToString(iPooled), iBehaviour);
+    SetLocalInt(oModule, \"b_pool_%(lower_name)s\", iPooled + 1);
+}
+""")
+"""The compiled shell for the functions that pool a behaviour's objects.
+@type: L{Template}
+"""
+
+drain_template = Template("""
+// Passes on a verb's completion, and then the completions z_b_%(lower_name)s
+// queued on oQueue while it was being passed on, in the order they came in.
+void drain_%(upper_name)s(object oQueue, int iBehaviour, int iVerb, int iReturn)
+{
+    int iQueued = 0;
+
+    // The count stays above zero until the queue is empty, so completions
+    // that come in meanwhile are queued behind this one.
+    SetLocalInt(oQueue, \"iCompletions\", 1);
+    while (TRUE)
+    {
+%(verb_count)s        if (iReturn == SUCCESS)
+        {
+            control_%(upper_name)s(iBehaviour, iVerb);
+        }
+        else
+        {
+            timeout_%(upper_name)s(iBehaviour);
+        }
+
+        iQueued++;
+        if (iQueued >= GetLocalInt(oQueue, \"iCompletions\"))
+        {
+            break;
+        }
+        iVerb = GetLocalInt(oQueue, \"iCompletionVerb\" + IntToString(iQueued));
+        iReturn = GetLocalInt(oQueue, \"iCompletionReturn\" + IntToString(iQueued));
+        DeleteLocalInt(oQueue, \"iCompletionVerb\" + IntToString(iQueued));
+        DeleteLocalInt(oQueue, \"iCompletionReturn\" + IntToString(iQueued));
+    }
+    DeleteLocalInt(oQueue, \"iCompletions\");
+}
+""")
+"""The compiled shell for the function that passes on verb completions
+(see L{Behaviour.direct_completion}).
+@type: L{Template}
+"""
+
+event_descriptions = {"perception":"when the actor perceives something;\n// call it from the actor's OnPerception script",
+                      "damage":"when the actor is damaged;\n// call it from the actor's OnDamaged script",
+                      "area_enter":"when the actor enters an area;\n// call it from the area's OnEnter script",
+                      "conversation_end":"when the actor's conversation ends;\n// call it from the conversation's end scripts"}
+"""What each of the L{verb_events} hooks is for, as described in its declaration.
+@type: dict
+"""
+
+z_b_template = Template("""\
+/* CODE GENERATED BY BEHAVIOUR TOOL */
+
+#include \"b_%(lower_name)s\"
+
+// main will be called by a verb when it has been completed, through ExecuteScript.
+void main()
+{
+    int iBehaviour = GetLocalInt(GetModule(), \"curr_behaviour\");
+%(resume_check)s%(verb_count)s    int iReturn = getVerbReturn(iBehaviour);
+    int iVerb = getVerbFinished(iBehaviour);
+
+    if (iReturn == SUCCESS)
+    {
+        control_%(upper_name)s(iBehaviour, iVerb);
+    }
+    else
+    {
+        timeout_%(upper_name)s(iBehaviour);
+    }
+}""")
+"""The compiled shell for C{z_b_<behaviour>} files.
+@type: L{Template}
+"""
+
+z_b_queue_template = Template("""\
+/* CODE GENERATED BY BEHAVIOUR TOOL */
+
+#include \"b_%(lower_name)s\"
+
+// main will be called by a verb when it has been completed, through ExecuteScript
+// on the behaviour object.
+void main()
+{
+    int iBehaviour = GetLocalInt(OBJECT_SELF, \"ID\");
+%(resume_check)s    int iVerb = getVerbFinished(iBehaviour);
+    int iReturn = getVerbReturn(iBehaviour);
+
+    // If a completion is already being passed on, this one came in from
+    // inside it, so queue it to be passed on after.
+    int iQueued = GetLocalInt(OBJECT_SELF, \"iCompletions\");
+    if (iQueued)
+    {
+        SetLocalInt(OBJECT_SELF, \"iCompletionVerb\" + IntToString(iQueued), iVerb);
+        SetLocalInt(OBJECT_SELF, \"iCompletionReturn\" + IntToString(iQueued), iReturn);
+        SetLocalInt(OBJECT_SELF, \"iCompletions\", iQueued + 1);
+        return;
+    }
+
+    drain_%(upper_name)s(OBJECT_SELF, iBehaviour, iVerb, iReturn);
+}""")
+"""The compiled shell for C{z_b_<behaviour>} files that pass completions on
+directly (see L{Behaviour.direct_completion}).
+@type: L{Template}
+"""
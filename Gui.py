@@ -46,9 +46,15 @@ class Model(object):
         @type: L{Behaviour}
         """
         self.actual_verbs = []
-        """The actual verbs that are defined in C{util_verbs.nss}.
+        """The actual verbs that are defined in C{util_verbs.nss} and the
+        scripts it includes.
         @type: list of L{ActualVerb}s
         """
+        self.verb_conflicts = []
+        """The actual verbs that were defined more than once, as
+        C{(name, path kept, path ignored)}.
+        @type: list of tuples
+        """
         self.actual_verb_names = []
         """The names of the actual verbs stored in actual_verbs.
         
@@ -91,6 +97,13 @@ class Model(object):
         on the verb panel, so it is useful to maintain.
         @type: list of strings
         """
+        self.release_build = False
+        """Should behaviours be generated without their heartbeat DebugPrint calls?
+
+        This is kept in the config rather than in each behaviour, and applied
+        to every behaviour that is created or opened.
+        @type: bool
+        """
         self.space = 3
         """The amount of space between widgets in the GUI.
         @type: int
@@ -153,6 +166,7 @@ class Model(object):
         self.verb_names = []
         for verb in self.behaviour.verbs:
             self.verb_names.append(verb.context_name)
+        self.behaviour.verbs.Reindex()
     
     def UpdateNWVarNames(self):
         """Updates the four lists concerning NWVariable names that combo boxes use.
@@ -175,12 +189,33 @@ class Model(object):
                 self.float_names.append(nwvar.name)
     
     def LoadUtilVerbs(self, path):
-        """Try to load the C{util_verbs.nss} file at the given path.
+        """Try to load the C{util_verbs.nss} file at the given path, along
+        with the scripts it includes.
         @param path: Path to the C{util_verbs.nss} file.
         @type path: string
         """
-        self.actual_verbs = Io.LoadActualVerbs(path)
+        self.actual_verbs, self.verb_conflicts = Io.LoadVerbLibrary(path)
         self.UpdateActualVerbNames()
+    
+    def DescribeVerbConflicts(self):
+        """Describe the actual verbs that were defined more than once.
+        @return: One line per conflict.
+        @rtype: string
+        """
+        lines = ["Some verbs are defined more than once.  The first definition is used."]
+        for name, kept, ignored in self.verb_conflicts:
+            lines.append("%s: using %s, ignoring %s" % (name, os.path.basename(kept), os.path.basename(ignored)))
+        return '\n'.join(lines)
+    
+    def DescribeDroppedVerbs(self):
+        """Describe the verbs that were left out of the last b_ script generated.
+        @return: One line per verb.
+        @rtype: string
+        """
+        lines = ["Some verbs can't be reached from the first verb, so they were left out of the script."]
+        for verb in self.behaviour.dropped_verbs:
+            lines.append("%s (%s)" % (verb.context_name, verb.actual_name))
+        return '\n'.join(lines)
 
 # Make a global model and config to be used by the GUI.
 #  We could instead pass this object to each widget, but the model is in the gui
@@ -282,6 +317,12 @@ class BOptionsDialog(wx.Dialog):
                                   (self.util_verbs_tc, 1, wx.EXPAND|wx.ALL, model.space),
                                   (open_btn, 0, wx.ALL, model.space)])
         
+        # Release build (CheckBox)
+        self.release_cb = wx.CheckBox(self, wx.ID_ANY, "Release build (leave out heartbeat DebugPrint calls)")
+        """The CheckBox that turns release builds on and off.
+        @type: wx.CheckBox
+        """
+        
         # Horizontal line
         line = wx.StaticLine(self, wx.ID_ANY, style=wx.LI_HORIZONTAL)
         
@@ -299,9 +340,10 @@ class BOptionsDialog(wx.Dialog):
         
         button_sizer.Realize()
         
-        # Main sizer[util_verbs sizer, line, button sizer]
+        # Main sizer[util_verbs sizer, release build, line, button sizer]
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.AddMany([(util_verbs_sizer, 0, wx.ALL, model.space),
+                       (self.release_cb, 0, wx.ALL, model.space*2),
                        (line, 0, wx.EXPAND|wx.ALIGN_CENTER|wx.ALL, model.space),
                        (button_sizer, 0, wx.ALIGN_CENTER|wx.ALL, model.space)])
         
@@ -313,6 +355,7 @@ class BOptionsDialog(wx.Dialog):
         """Loads up the data from the config object."""
         if config.has_option("Options", "util_verbs_location"):
             self.util_verbs_tc.SetValue(config.get("Options", "util_verbs_location"))
+        self.release_cb.SetValue(model.release_build)
     
     #{ Event handlers
     
@@ -351,8 +394,20 @@ class BOptionsDialog(wx.Dialog):
                 fail_dlg.ShowModal()
                 fail_dlg.Destroy()
                 self.util_verbs_tc.SetValue("")
+            else:
+                if len(model.verb_conflicts) > 0:
+                    warn_dlg = wx.MessageDialog(self,
+                                                model.DescribeVerbConflicts(),
+                                                "Warning",
+                                                wx.OK|wx.ICON_WARNING)
+                    warn_dlg.ShowModal()
+                    warn_dlg.Destroy()
         else:
             config.set("Options", "util_verbs_location", util_verbs_path)
+        
+        model.release_build = self.release_cb.GetValue()
+        model.behaviour.release_build = model.release_build
+        config.set("Options", "release_build", str(model.release_build))
 
 class ActorListCtrl(wx.ListCtrl, listmix.ListCtrlAutoWidthMixin, listmix.TextEditMixin):
     """The ActorListCtrl is the widget that actors will be inputted into.
@@ -592,7 +647,7 @@ class VerbCanvas(ogl.ShapeCanvas):
                 line.SetBrush(wx.BLACK_BRUSH)
                 line.AddArrow(ogl.ARROW_ARROW)
                 line.MakeLineControlPoints(2)
-                self.shapes[ix].AddLine(line, self.shapes[model.behaviour.verbs.index(follower)])
+                self.shapes[ix].AddLine(line, self.shapes[model.behaviour.verbs.IndexOf(follower)])
                 self.diagram.AddShape(line)
                 line.Show(True)
         
@@ -1993,6 +2048,15 @@ class VerbPanel(wx.Panel):
                                             wx.OK|wx.ICON_ERROR)
                 fail_dlg.ShowModal()
                 fail_dlg.Destroy()
+            
+            else:
+                if len(model.verb_conflicts) > 0:
+                    warn_dlg = wx.MessageDialog(self,
+                                                model.DescribeVerbConflicts(),
+                                                "Warning",
+                                                wx.OK|wx.ICON_WARNING)
+                    warn_dlg.ShowModal()
+                    warn_dlg.Destroy()
         
         open_dlg.Destroy()
     
@@ -2127,7 +2191,7 @@ class VerbPanel(wx.Panel):
         @param follower: The verb we wish to add as a follower on the panel.
         @type follower: L{Verb}
         """
-        select = model.behaviour.verbs.index(follower)
+        select = model.behaviour.verbs.IndexOf(follower)
         
         if select >= 0:
             # Follower (Choice)
@@ -2515,6 +2579,14 @@ class MainFrame(wx.Frame):
         if config.has_section("Options") is not True:
             config.add_section("Options")
         
+        # Parsed scripts are cached next to the config, unless it says otherwise.
+        # The path is made absolute now, since the file dialogs change the
+        # working directory.
+        if config.has_option("Options", "cache_directory"):
+            Io.cache_directory = os.path.abspath(config.get("Options", "cache_directory"))
+        else:
+            Io.cache_directory = os.path.abspath("BehaviourTool.cache")
+        
         # Load up certain options if we have them
         if config.has_option("Options", "util_verbs_location"):
             try:
@@ -2522,11 +2594,18 @@ class MainFrame(wx.Frame):
                 model.LoadUtilVerbs(path)
             except:
                 config.remove_option("Options", "util_verbs_location")
+        if config.has_option("Options", "release_build"):
+            try:
+                model.release_build = config.getboolean("Options", "release_build")
+            except ValueError:
+                config.remove_option("Options", "release_build")
+            model.behaviour.release_build = model.release_build
     
     def __createMainMenu(self):
         """Create the main menu for the main frame and bind the events."""
         # For the main menu
         ID_OPTIONS = wx.NewId()
+        ID_SCHEDULER = wx.NewId()
         ID_HELP = wx.NewId()
         
         # File menu
@@ -2577,6 +2656,9 @@ class MainFrame(wx.Frame):
         #tools_menu.Append(1, "&Test Behaviour", "Test the current behaviour.")
         #self.Bind(wx.EVT_MENU, self.OnTest, id=1)
         
+        tools_menu.Append(ID_SCHEDULER, "Generate &Scheduler...", "Generate the script that runs the scheduled behaviours.")
+        self.Bind(wx.EVT_MENU, self.OnGenerateScheduler, id=ID_SCHEDULER)
+        
         tools_menu.Append(ID_OPTIONS, "&Options...", "Configure the Behaviour Tool.")
         self.Bind(wx.EVT_MENU, self.OnOptions, id=ID_OPTIONS)
         # end Tools menu
@@ -2610,6 +2692,7 @@ class MainFrame(wx.Frame):
         """
         if self.PromptToSave() == True:
             model.behaviour = Codegen.Behaviour()
+            model.behaviour.release_build = model.release_build
             model.UpdateVerbNames()
             model.UpdateNWVarNames()
             self.notebook.DeleteAllPages()
@@ -2634,6 +2717,7 @@ class MainFrame(wx.Frame):
                 
                 try:
                     model.behaviour = Io.LoadBehaviour(path)
+                    model.behaviour.release_build = model.release_build
                     model.UpdateVerbNames()
                     model.UpdateNWVarNames()
                     self.notebook.DeleteAllPages()
@@ -2727,6 +2811,39 @@ class MainFrame(wx.Frame):
     #def OnTest(self, event):
     #    pass
     
+    def OnGenerateScheduler(self, event):
+        """Prompt for the module's behaviours, then save the scheduler script
+        that runs the scheduled ones in the same directory.
+        @param event: Event created by EVT_MENU.
+        @type event: wx.CommandEvent
+        """
+        open_dlg = wx.FileDialog(self,
+                                 message="Select the module's b_<behaviour>.nss files",
+                                 defaultDir=os.getcwd(),
+                                 wildcard="Behaviour scripts (b_*.nss)|b_*.nss",
+                                 style=wx.OPEN|wx.MULTIPLE)
+        
+        if open_dlg.ShowModal() == wx.ID_OK:
+            paths = open_dlg.GetPaths()
+            
+            try:
+                behaviours = [Io.LoadBehaviour(path) for path in paths]
+                path = os.path.join(os.path.dirname(paths[0]), "s_behaviours.nss")
+                Io.SaveSchedulerFile(path, behaviours)
+                message = "Saved the scheduler as %s." % os.path.basename(path)
+                if True not in [behaviour.scheduled for behaviour in behaviours]:
+                    message += "\nNone of the behaviours are scheduled, so it won't run any of them."
+                done_dlg = wx.MessageDialog(self, message, "Scheduler", wx.OK|wx.ICON_INFORMATION)
+            except:
+                done_dlg = wx.MessageDialog(self,
+                                            "The scheduler could not be generated!",
+                                            "Error",
+                                            wx.OK|wx.ICON_ERROR)
+            done_dlg.ShowModal()
+            done_dlg.Destroy()
+        
+        open_dlg.Destroy()
+    
     def OnOptions(self, event):
         """Show the L{BOptionsDialog} to allow the user to edit program options.
         @param event: Event created by EVT_MENU.
@@ -2791,7 +2908,6 @@ class MainFrame(wx.Frame):
                 try:
                     Io.SaveBFile(b_file, model.behaviour)
                     Io.SaveZBFile(z_b_file, model.behaviour)
-                    return True
                 except:
                     fail_dlg = wx.MessageDialog(self,
                                                 "Error saving the script files.",
@@ -2799,6 +2915,9 @@ class MainFrame(wx.Frame):
                                                 wx.OK|wx.ICON_ERROR)
                     fail_dlg.ShowModal()
                     fail_dlg.Destroy()
+                else:
+                    self.__warnDroppedVerbs()
+                    return True
         
         dlg = wx.DirDialog(self, "Choose the directory containing your module's files.",
                            defaultPath=os.getcwd(),
@@ -2815,7 +2934,6 @@ class MainFrame(wx.Frame):
             try:
                 Io.SaveBFile(b_file, model.behaviour)
                 Io.SaveZBFile(z_b_file, model.behaviour)
-                return True
             except:
                 fail_dlg = wx.MessageDialog(self,
                                             "Error saving the script files.",
@@ -2824,10 +2942,23 @@ class MainFrame(wx.Frame):
                 fail_dlg.ShowModal()
                 fail_dlg.Destroy()
                 return False
+            else:
+                self.__warnDroppedVerbs()
+                return True
         
         else:
             return False    
     
+    def __warnDroppedVerbs(self):
+        """Tell the user which verbs were left out of the script just saved, if any."""
+        if len(model.behaviour.dropped_verbs) > 0:
+            warn_dlg = wx.MessageDialog(self,
+                                        model.DescribeDroppedVerbs(),
+                                        "Warning",
+                                        wx.OK|wx.ICON_WARNING)
+            warn_dlg.ShowModal()
+            warn_dlg.Destroy()
+    
     def PromptToSave(self):
         """Prompts the user to save the current behaviour.        
         @return: Did the user make a choice? (i.e., did they B{not} press C{Cancel}?)
@@ -23,9 +23,88 @@
 # TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
 # EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import os.path
+import os, os.path
+import cPickle
+import hashlib
+import Codegen
 import Parser
 
+cache_directory = None
+"""The directory where parsed scripts are cached, or None to always parse them.
+
+Each script that is loaded gets one file in the directory, holding the parsed
+objects and the path, size, modification time and MD5 hash of the script they
+were parsed from.  If any of those have changed, the script is parsed again.
+@type: string
+"""
+
+cache_version = 2
+"""Stored with each cached script.  Change it whenever the pickled form of the
+parsed objects changes, so old caches are ignored.
+@type: int
+"""
+
+def LoadScript(path, parse):
+    """Read a script from disk and parse it, going through the cache in
+    L{cache_directory} if there is one.
+    @param path: Path to the script.
+    @type path: string
+    @param parse: The function that parses the lines of the script.
+    @type parse: function
+    @return: The objects returned by C{parse}.  Objects taken from the cache
+        are new copies, so changing them won't affect later loads.
+    """
+    FILE = open(path, 'r')
+    try:
+        stat = os.fstat(FILE.fileno())
+        script = FILE.readlines()
+    finally:
+        FILE.close()
+
+    if cache_directory is None:
+        return parse(script)
+
+    full_path = os.path.normcase(os.path.abspath(path))
+    key = (cache_version, parse.__name__, full_path, stat.st_size,
+           stat.st_mtime, hashlib.md5(''.join(script)).hexdigest())
+    # Each parser gets its own cache file, so parsing the same script two
+    # ways doesn't keep replacing one cache with the other.
+    cache_path = os.path.join(cache_directory,
+                              hashlib.md5(parse.__name__ + full_path).hexdigest() + ".cache")
+
+    # The key is pickled on its own, so a stale cache can be spotted without
+    # unpickling the objects.  A cache that can't be read is just ignored.
+    try:
+        FILE = open(cache_path, 'rb')
+        try:
+            if cPickle.load(FILE) == key:
+                return cPickle.load(FILE)
+        finally:
+            FILE.close()
+    except Exception:
+        pass
+
+    parsed = parse(script)
+
+    # Write to a temporary file first, so a half-written cache is never read.
+    temp_path = cache_path + ".tmp"
+    try:
+        if not os.path.isdir(cache_directory):
+            os.makedirs(cache_directory)
+        FILE = open(temp_path, 'wb')
+        try:
+            cPickle.dump(key, FILE, cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(parsed, FILE, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            FILE.close()
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        os.rename(temp_path, cache_path)
+    except (IOError, OSError):
+        pass
+
+    return parsed
+
 def LoadActualVerbs(path):
     """Loads and parses the C{util_verbs.nss} file.
     @param path: Path to the C{util_verbs.nss} file.
@@ -38,15 +117,56 @@ def LoadActualVerbs(path):
     if os.path.basename(path) != "util_verbs.nss":
         raise IOError, -1, "Filename must be 'util_verbs.nss'"
     
-    FILE = open(path, 'r')
-    script = FILE.readlines()
-    FILE.close()
-    
     # Get a list of ActualVerbs by parsing util_verbs
-    actual_verbs = Parser.ParseVerbs(script)
+    actual_verbs = LoadScript(path, Parser.ParseVerbs)
     
     return actual_verbs
 
+def LoadVerbLibrary(path):
+    """Loads the actual verbs from a script and every script it includes,
+    directly or indirectly.
+
+    Included scripts are looked for in the directory of the script that
+    includes them.  Those that aren't there, like the standard includes,
+    are skipped.  Each script goes through L{LoadScript} separately, so
+    changing one script only means that script is parsed again.
+    @param path: Path to the first script, usually C{util_verbs.nss}.
+    @type path: string
+    @return: The L{ActualVerb}s, and the conflicts.  If a verb is defined
+        more than once, the first definition is kept and the conflict is
+        described as C{(name, path kept, path ignored)}.  A script's own
+        verbs come before those of the scripts it includes.
+    @rtype: tuple of (list of L{ActualVerb}s, list of tuples)
+    """
+    actual_verbs = []
+    conflicts = []
+    defined = {}
+    loaded = set()
+    pending = [path]
+    while len(pending) > 0:
+        script_path = pending.pop()
+        full_path = os.path.normcase(os.path.abspath(script_path))
+        if full_path in loaded:
+            continue
+        loaded.add(full_path)
+
+        includes, verbs = LoadScript(script_path, Parser.ParseVerbLibrary)
+        for verb in verbs:
+            if verb.name in defined:
+                conflicts.append((verb.name, defined[verb.name], script_path))
+                continue
+            defined[verb.name] = script_path
+            actual_verbs.append(verb)
+
+        # The includes are pushed in reverse, so the first one is loaded next.
+        directory = os.path.dirname(script_path)
+        for name in reversed(includes):
+            include_path = os.path.join(directory, name + ".nss")
+            if os.path.isfile(include_path):
+                pending.append(include_path)
+
+    return (actual_verbs, conflicts)
+
 def LoadBehaviour(path):
     """Loads and parses a generated script file from disk.
 
@@ -63,14 +183,25 @@ def LoadBehaviour(path):
     if os.path.basename(path)[0:2] != "b_":
         raise IOError, -1, "Filename must start with b_"
 
+    # Get a behaviour object by parsing the script
+    out_behaviour = LoadScript(path, Parser.ParseBehaviour)
+
+    return out_behaviour
+
+def LoadPreconditionProfile(path, behaviour):
+    """Loads the precondition timings measured by a profiling run, so the
+    behaviour's preconditions can be ordered by them.
+    @param path: Path to the profile.
+    @type path: string
+    @param behaviour: The behaviour the timings were measured for.  Its
+        L{precondition_timings<Behaviour.precondition_timings>} are updated.
+    @type behaviour: L{Behaviour}
+    """
     FILE = open(path, 'r')
     script = FILE.readlines()
     FILE.close()
 
-    # Get a behaviour object by parsing the script
-    out_behaviour = Parser.ParseBehaviour(script)
-
-    return out_behaviour
+    behaviour.precondition_timings.update(Parser.ParseProfile(script))
 
 def SaveBFile(path, behaviour):
     """Saves the b_ code generated from the passed behaviour to disk.
@@ -86,9 +217,12 @@ def SaveBFile(path, behaviour):
     if os.path.basename(path)[0:2] != "b_":
         raise IOError, -1, "Filename must start with b_"
     
+    # The code is written out as it is generated, rather than all at once.
     FILE = open(path, 'w')
-    FILE.write(behaviour.GenerateBCode())
-    FILE.close()
+    try:
+        behaviour.WriteBCode(FILE)
+    finally:
+        FILE.close()
 
 def SaveZBFile(path, behaviour):
     """Saves the z_b_ code generated from the passed behaviour to disk.
@@ -104,6 +238,24 @@ def SaveZBFile(path, behaviour):
     if os.path.basename(path)[0:4] != "z_b_":
         raise IOError, -1, "Filename must start with z_b_"
 
+    # The code is written out as it is generated, rather than all at once.
     FILE = open(path, 'w')
-    FILE.write(behaviour.GenerateZBCode())
-    FILE.close()
+    try:
+        behaviour.WriteZBCode(FILE)
+    finally:
+        FILE.close()
+
+def SaveSchedulerFile(path, behaviours):
+    """Saves the module's scheduler script, generated from the passed behaviours, to disk.
+    @param path: Path where we would like to save the scheduler script.
+    @type path: string
+    @param behaviours: The behaviours in the module.  Only the scheduled ones
+        are run by the scheduler.
+    @type behaviours: list of L{Behaviour}s
+    """
+    # The code is written out as it is generated, rather than all at once.
+    FILE = open(path, 'w')
+    try:
+        Codegen.WriteSchedulerCode(FILE, behaviours)
+    finally:
+        FILE.close()
@@ -41,251 +41,332 @@ class ParseError(Exception):
         """
         return repr(self.value)
 
+verb_index_re = re.compile(r"^/\* (?P<name>\w+) verb.*\nDescription: .*\nVerbData Arguments: ", re.M)
+"""Matches the first three lines of a verb's comment block in C{util_verbs.nss}.
+@type: regular expression
+"""
+
+description_re = re.compile(r"Description: (?P<description>.*)")
+"""Matches the description line of a verb's comment block.
+@type: regular expression
+"""
+
+vdarguments_re = re.compile(r"VerbData Arguments: (?P<vdargs>.*)")
+"""Matches the VerbData arguments line of a verb's comment block.
+@type: regular expression
+"""
+
+varguments_re = re.compile(r"Verb Arguments:")
+"""Matches the line that starts the list of verb arguments.
+@type: regular expression
+"""
+
+vargument_re = re.compile(r"    (?P<type>\w+) (?P<name>\w+) (?P<mandatory>\S+) - (?P<description>.*)")
+"""Matches one of the lines in the list of verb arguments.
+@type: regular expression
+"""
+
 def ParseVerbs(script):
     """Parses the C{util_verbs.nss} script to generate a list of ActualVerbs.
+
+    This only finds the name of each verb and where its comment block starts,
+    which is a single pass of one regular expression over the script.  The
+    description and arguments of a verb are parsed by L{ParseVerbDetails}
+    the first time they are needed.
     @param script: The entirety of the C{util_verbs.nss} script.
     @type script: list of strings
     @return: The ActualVerbs described in the C{util_verbs.nss} script.
     @rtype: list of L{ActualVerb}s
     """
+    # Every verb shares the one copy of the script.
+    source = ''.join(script)
 
-    # Set up the list
+    # /* <Verb name> verb
+    # Description: <Verb description>
+    # VerbData Arguments: <vdarguments separated by spaces>
     actual_verbs = []
-    
-    # Regular expressions to parse the verb comments.
-    name_re = re.compile(r"/\* (?P<name>\w+) verb")
-    description_re = re.compile(r"Description: (?P<description>.*)")
-    vdarguments_re = re.compile(r"VerbData Arguments: (?P<vdargs>.*)")
-    varguments_re = re.compile(r"Verb Arguments:")
-    vargument_re = re.compile(r"    (?P<type>\w+) (?P<name>\w+) (?P<mandatory>\S+) - (?P<description>.*)")
-    
-    # Make a list of line #'s that contain /*; each will identify a verb.
+    for match_object in verb_index_re.finditer(source):
+        actual_verbs.append(Codegen.ActualVerb(name=match_object.group("name"),
+                                               source=source,
+                                               offset=match_object.start(),
+                                               loader=ParseVerbDetails))
+
+    return actual_verbs
+
+include_re = re.compile(r'^[ \t]*#include[ \t]+"(?P<name>[^"]+)"', re.M)
+"""Matches an C{#include} line, capturing the name of the included script.
+@type: regular expression
+"""
+
+def ParseVerbLibrary(script):
+    """Parses one script of a verb library: C{util_verbs.nss}, or one of the
+    scripts it includes.
+    @param script: The entirety of the script.
+    @type script: list of strings
+    @return: The names of the scripts it includes, without the C{.nss}
+        extension, and the ActualVerbs it describes.
+    @rtype: tuple of (list of strings, list of L{ActualVerb}s)
+    """
+    # #include "<script name>"
+    includes = include_re.findall(''.join(script))
+
+    return (includes, ParseVerbs(script))
+
+def ParseVerbDetails(verb):
+    """Parses the description and arguments of an ActualVerb found by L{ParseVerbs}.
+    @param verb: The verb to fill in.  Its C{source} and C{offset} give the
+        script and where the verb's comment block starts in it.
+    @type verb: L{ActualVerb}
+    """
+    source = verb.source
+
+    # Split off the first four lines of the comment block.
     lines = []
-    
-    for ix, line in enumerate(script):
-        if line.find("/*") != -1:
-            lines.append(ix)
-    
-    # Parse each verb's comment block.
-    for ix in lines:
-        # /* <Verb name> verb
-        match_object = name_re.match(script[ix])
-        
+    position = verb.offset
+    for ix in range(4):
+        newline = source.find("\n", position)
+        if newline == -1:
+            newline = len(source)
+        lines.append(source[position:newline])
+        position = newline + 1
+
+    # Description: <Verb description>
+    match_object = description_re.match(lines[1])
+    if match_object is not None:
+        verb.description = match_object.group("description")
+
+    # VerbData Arguments: <vdarguments separated by spaces>
+    match_object = vdarguments_re.match(lines[2])
+    if match_object is not None:
+        for vdarg in match_object.group("vdargs").split():
+            verb.vdarguments.append(vdarg)
+
+    # Verb Arguments:
+    match_object = varguments_re.match(lines[3])
+    if match_object is None:
+        return
+
+    # The arguments run up to the line containing '*/'
+    end = source.find("*/", position)
+    if end == -1:
+        end = len(source)
+    end = source.rfind("\n", position, end) + 1
+
+    # Go through each verb argument
+    for line in source[position:end].split("\n"):
+        #     <type> <name> <mandatory> - <description>
+        match_object = vargument_re.match(line)
+
         if match_object is None:
             continue
-        verb = Codegen.ActualVerb()
-        verb.name = match_object.group("name")
 
-        # Description: <Verb description>
-        match_object = description_re.match(script[ix+1])
-        
-        if match_object is None:
+        mandatory = match_object.group("mandatory") == "[Mandatory]"
+        type = match_object.group("type")
+        name = match_object.group("name")
+        description = match_object.group("description")
+
+        verb.varguments.append((mandatory, type, name, description))
+
+def ParseProfile(script):
+    """Parses the precondition timings measured by a profiling run.
+
+    Each line holds a precondition's cost, how often it failed, and the
+    precondition itself, seperated by ;; (e.g. C{0.8;; 0.95;; GetIsDead(oVictim)}).
+    The rejection rate can be left blank if it wasn't measured.  Blank lines
+    and lines starting with // are skipped.
+    @param script: The lines of the profile.
+    @type script: list of strings
+    @return: The timings, keyed by precondition (see L{Behaviour.precondition_timings}).
+    @rtype: dict
+    @raise ParseError: Raised if a line is malformed.
+    """
+    timing_re = re.compile(r"\s*(?P<cost>[^;]*);;\s*(?P<rejection>[^;]*);;\s*(?P<precondition>.*\S)\s*$")
+
+    timings = {}
+    for line in script:
+        if line.strip() == "" or line.lstrip().startswith("//"):
             continue
-        verb.description = match_object.group("description")
-        
-        # VerbData Arguments: <vdarguments separated by spaces>
-        match_object = vdarguments_re.match(script[ix+2])
-        
+
+        match_object = timing_re.match(line)
         if match_object is None:
-            continue
-        vdargs = match_object.group("vdargs")
-        vdargs_list = vdargs.split()
-        for vdarg in vdargs_list:
-            verb.vdarguments.append(vdarg)
-        
-        # Verb Arguments:
-        match_object = varguments_re.match(script[ix+3])
-        
-        if match_object is not None:
-            # Find the line containing '*/'
-            start_ix = end_ix = ix+4
-            while script[end_ix].find("*/") == -1:
-                end_ix += 1
-            
-            # Go through each verb argument
-            for v_ix in range(end_ix - start_ix):
-                #     <type> <name> <mandatory> - <description>
-                match_object = vargument_re.match(script[start_ix+v_ix])
-                
-                if match_object is None:
-                    continue
-                
-                mandatory = match_object.group("mandatory") == "[Mandatory]"
-                type = match_object.group("type")
-                name = match_object.group("name")
-                description = match_object.group("description")
-                
-                verb.varguments.append((mandatory, type, name, description))
-
-        # If we're here, we'll assume our parsing worked out,
-        # so add this actual verb to the list.
-        actual_verbs.append(verb)
-    
-    return actual_verbs
+            raise ParseError, "Malformed timing: %s" % line.strip()
+        try:
+            cost = float(match_object.group("cost"))
+            if match_object.group("rejection").strip() == "":
+                timing = cost
+            else:
+                timing = (cost, float(match_object.group("rejection")))
+        except ValueError:
+            raise ParseError, "Malformed timing: %s" % line.strip()
+        timings[match_object.group("precondition")] = timing
+
+    return timings
 
 def ParseBehaviour(script):
     """Parses the behaviour script to generate a behaviour object.
+
+    Only the opening comment block is read.  Each line in it is handled in
+    a single pass, according to the keyword it starts with, and the rest of
+    the script is never looked at.
     @param script: The entirety of the C{b_<behaviour>.nss} script.
     @type script: list of strings
     @return: The behaviour object able to generate the passed script.
     @rtype: L{Behaviour}
     @raise ParseError: Raised if the script's opening comment block is malformed;
-        if the comment markers do not line up, or a verb attempts to be manipulated
-        before it is declared.
+        if the comment markers do not line up, a verb attempts to be manipulated
+        before it is declared, or an unknown code generation option or event is set.
     """
 
     # Set up the behaviour object that we'll eventually return
     out_behaviour = Codegen.Behaviour()
 
-    # Regular expressions that will be used to parse the opening comment block.
-    behaviour_re = re.compile(r"BEHAVIOUR: (?P<name>\w+)")
-    verb_re = re.compile(r"VERB\d+: (?P<context_name>\w+) (?P<actual_name>\w+) (?P<follower>\w+) ?(?P<terminal>\w*)")
-    actor_re = re.compile(r"ACTOR\d+: (?P<type>\w+) (?P<name>\w+) (?P<description>.*)")
-    nwvar_re = re.compile(r"VARIABLE\d+: (?P<type>\w+) (?P<name>\w+) (?P<description>.*)")
-
-    verb_preconditions_re = re.compile(r"    VERB(?P<id>\d+)_PRECONDITIONS: (?P<preconds>.*)")
-    verb_followers_re = re.compile(r"    VERB(?P<id>\d+)_FOLLOWERS: (?P<followers>.*)")
-    verb_verbdata_re = re.compile(r"    VERB(?P<id>\d+)_VERBDATA: (?P<vdargs>.*)")
-    verb_arguments_re = re.compile(r"    VERB(?P<id>\d+)_ARGUMENTS: (?P<vargs>.*)")
-
-    # Find the first comment block
+    # Find the first comment block, and skip over the lines that don't
+    # contain useful information.
     for ix, line in enumerate(script):
         if line.find("/*") != -1:
-            start_block = ix
+            start_block = ix + 2
             break
+    else:
+        raise ParseError, "Error parsing the opening comment block!"
 
-    for ix, line in enumerate(script):
+    for line in script[start_block-2:start_block]:
         if line.find("*/") != -1:
-            end_block = ix
-            break
-
-    # Skip over the lines that don't contain useful information
-    start_block += 2
-
-    if start_block > end_block:
-        raise ParseError, "Error parsing the opening comment block!"
+            raise ParseError, "Error parsing the opening comment block!"
 
     # Since we won't know about all the verbs until we have finished parsing,
     # we'll keep a list of the follower relationships in memory until we have
     # finished parsing, then use the list afterwards to fill in the objects.
     all_followers = []
+    verbs = out_behaviour.verbs
 
     # Get the info we want from the opening comment block.
-    for ix in range(end_block - start_block):
-        line = script[start_block + ix]
+    for ix in xrange(start_block, len(script)):
+        line = script[ix]
+        if line.find("*/") != -1:
+            break
+        line = line.rstrip("\r\n")
 
-        # BEHAVIOUR: <name>
-        match_object = behaviour_re.match(line)
-        if match_object is not None:
-            out_behaviour.name = match_object.group("name")
-            continue
+        if line.startswith("    VERB"):
+            #     VERBx_<field>: <value>
+            head, separator, value = line.partition(": ")
+            number, underscore, field = head[8:].partition("_")
+            if separator == "" or underscore == "" or not number.isdigit():
+                print "Unable to parse line:", line
+                continue
+            v_ix = int(number) - 1
+            if v_ix < 0 or v_ix >= len(verbs):
+                raise ParseError, "Verb not yet declared."
+            verb = verbs[v_ix]
 
-        # VERBx: <context_name> <actual_name> <follower> <terminal>
-        match_object = verb_re.match(line)
-        if match_object is not None:
-            new_verb = Codegen.Verb(out_behaviour)
-            new_verb.context_name = match_object.group("context_name")
-            new_verb.actual_name = match_object.group("actual_name")
+            #     VERBx_FOLLOWERS: <followers seperated by spaces>
+            if field == "FOLLOWERS":
+                for follower in value.split():
+                    all_followers.append((verb, follower))
 
-            if match_object.group("follower") == "Follower":
-                new_verb.follower = True
-            else:
-                new_verb.follower = False
+            #     VERBx_ID: <verb_id>
+            elif field == "ID":
+                if not value.isdigit():
+                    print "Unable to parse line:", line
+                    continue
+                verb.verb_id = int(value)
 
-            if match_object.group("terminal") == "Terminal":
-                new_verb.terminal = True
-            else:
-                new_verb.terminal = False
+            #     VERBx_PRECONDITIONS: <preconditions seperated by ;;>
+            elif field == "PRECONDITIONS":
+                for precond in value.split(";;"):
+                    verb.preconditions.append(precond.strip(' ;'))
 
-            out_behaviour.verbs.append(new_verb)
-            continue
+            #     VERBx_VERBDATA: <vdarguments seperated by spaces>
+            elif field == "VERBDATA":
+                for vdarg in value.split():
+                    verb.vdarguments.append(vdarg)
 
-        #     VERBx_PRECONDITIONS: <preconditions seperated by ;;>
-        match_object = verb_preconditions_re.match(line)
-        if match_object is not None:
-            v_ix = int(match_object.group("id")) - 1
-            preconds = match_object.group("preconds")
-            preconds_list = preconds.split(";;")
-            for precond in preconds_list:
-                try:
-                    out_behaviour.verbs[v_ix].preconditions.append(precond.strip(' ;'))
-                except:
-                    raise ParseError, "Verb not yet declared."
-            continue
-
-        #     VERBx_FOLLOWERS: <followers seperated by spaces>
-        match_object = verb_followers_re.match(line)
-        if match_object is not None:
-            v_ix = int(match_object.group("id")) - 1
-            followers = match_object.group("followers")
-            followers_list = followers.split()
-            for follower in followers_list:
-                all_followers.append((new_verb.context_name, follower))
-            continue
+            #     VERBx_ARGUMENTS: <varguments seperated by ;;>
+            elif field == "ARGUMENTS":
+                for varg in value.split(";;"):
+                    verb.varguments.append(varg.strip(' ;'))
 
-        #     VERBx_VERBDATA: <vdarguments seperated by spaces>
-        match_object = verb_verbdata_re.match(line)
-        if match_object is not None:
-            v_ix = int(match_object.group("id")) - 1
-            vdargs = match_object.group("vdargs")
-            vdargs_list = vdargs.split()
-            for vdarg in vdargs_list:
+            #     VERBx_EVENTS: <events seperated by spaces>
+            elif field == "EVENTS":
+                verb.events = value.split()
                 try:
-                    out_behaviour.verbs[v_ix].vdarguments.append(vdarg)
-                except:
-                    raise ParseError, "Verb not yet declared."
-            continue
+                    verb.GetEventMask()
+                except ValueError, e:
+                    raise ParseError, str(e)
 
-        #     VERBx_ARGUMENTS: <varguments seperated by ;;>
-        match_object = verb_arguments_re.match(line)
-        if match_object is not None:
-            v_ix = int(match_object.group("id")) - 1
-            vargs = match_object.group("vargs")
-            vargs_list = vargs.split(";;")
-            for varg in vargs_list:
-                try:
-                    out_behaviour.verbs[v_ix].varguments.append(varg.strip(' ;'))
-                except:
-                    raise ParseError, "Verb not yet declared."
-            continue
+            else:
+                print "Unable to parse line:", line
 
+        elif line.startswith("VERB"):
+            # VERBx: <context_name> <actual_name> <follower> <terminal>
+            head, separator, value = line.partition(": ")
+            fields = value.split()
+            if separator == "" or not head[4:].isdigit() or len(fields) < 3:
+                print "Unable to parse line:", line
+                continue
+            new_verb = Codegen.Verb(out_behaviour)
+            new_verb.context_name = fields[0]
+            new_verb.actual_name = fields[1]
+            new_verb.follower = fields[2] == "Follower"
+            new_verb.terminal = fields[3:4] == ["Terminal"]
+            verbs.append(new_verb)
 
-        # ACTORx: <type> <name> <description>
-        match_object = actor_re.match(line)
-        if match_object is not None:
+        elif line.startswith("ACTOR") or line.startswith("VARIABLE"):
+            # ACTORx: <type> <name> <description>
+            # VARIABLEx: <type> <name> <description>
+            head, separator, value = line.partition(": ")
+            fields = value.split(" ", 2)
+            if separator == "" or len(fields) < 2:
+                print "Unable to parse line:", line
+                continue
+            fields.append("")
             out_behaviour.nwvariables.append(\
                 Codegen.NWVariable(\
-                    type=match_object.group("type"),\
-                    name=match_object.group("name"),\
-                    description=match_object.group("description"),\
-                    isActor=True))
-            continue
+                    type=fields[0],\
+                    name=fields[1],\
+                    description=fields[2],\
+                    isActor=line.startswith("ACTOR")))
 
-        # VARIABLEx: <type> <name> <description>
-        match_object = nwvar_re.match(line)
-        if match_object is not None:
-            out_behaviour.nwvariables.append(\
-                Codegen.NWVariable(\
-                    type=match_object.group("type"),\
-                    name=match_object.group("name"),\
-                    description=match_object.group("description"),\
-                    isActor=False))
-            continue
+        elif line.startswith("BEHAVIOUR: "):
+            # BEHAVIOUR: <name>
+            name = line[11:].split()
+            if len(name) == 0:
+                print "Unable to parse line:", line
+                continue
+            out_behaviour.name = name[0]
 
-        print "Unable to parse line:", line
+        elif line.startswith("OPTIONS: "):
+            # OPTIONS: <options seperated by spaces>
+            for option in line[9:].split():
+                try:
+                    out_behaviour.SetOption(option)
+                except ValueError, e:
+                    raise ParseError, str(e)
+
+        else:
+            print "Unable to parse line:", line
+    else:
+        raise ParseError, "Error parsing the opening comment block!"
 
     # After we've parsed the comment block, we'll run through our list of
-    # follower relationships.
-    for follow_pair in all_followers:
-        for verb in out_behaviour.verbs:
-            if verb.context_name == follow_pair[0]:
-                v1 = verb
-                break
-        for verb in out_behaviour.verbs:
-            if verb.context_name == follow_pair[1]:
-                v2 = verb
-                break
-        
-        v1.followers.append(v2)
+    # follower relationships.  If two verbs share a name, the first one wins.
+    for verb, name in all_followers:
+        follower = verbs.GetVerb(name)
+        if follower is None:
+            print "Unknown follower:", name
+            continue
+        verb.followers.append(follower)
+
+    # Scripts saved before verb IDs were stored in the comment block
+    # numbered the verbs by position, so we'll give them the same IDs.
+    # That way the constants won't change when the behaviour is saved again.
+    for verb in out_behaviour.verbs:
+        if verb.verb_id is not None:
+            break
+    else:
+        for index, verb in enumerate(out_behaviour.verbs):
+            if verb.follower == True:
+                verb.verb_id = (index*2)+2
+            else:
+                verb.verb_id = (index*2)+1
 
     return out_behaviour